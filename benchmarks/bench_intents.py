@@ -0,0 +1,173 @@
+# ============================================
+#  BENCHMARK INTENTS / CACHE (mode complet vs LEAN_MODE)
+#  Rejoue un démarrage synthétique dans le ConnectionState de discord.py,
+#  avec la configuration réelle du bot de main.py :
+#   - GUILD_CREATE de N serveurs (rôles, salons, emojis)
+#   - chunking des membres au démarrage (+ présences) si le mode le demande
+#   - un flux de MESSAGE_CREATE (cache de messages)
+#   - régime établi : un flux de GUILD_MEMBER_ADD (nouveaux membres), pour
+#     mesurer la croissance du cache de membres une fois démarré
+#  Chaque mode tourne dans un processus séparé : temps de "démarrage",
+#  RSS ajoutée, objets en cache.
+#
+#  Usage: python benchmarks/bench_intents.py [nb_serveurs] [membres_par_serveur] [joins_par_serveur]
+# ============================================
+
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHUNK_SIZE = 1000  # membres par GUILD_MEMBERS_CHUNK (valeur Discord)
+MESSAGES_PER_GUILD = 2000
+
+
+def rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def user_payload(uid):
+    return {"id": str(uid), "username": f"user{uid}", "discriminator": "0", "global_name": f"User {uid}", "avatar": None}
+
+
+def member_payload(uid, role_ids):
+    return {"user": user_payload(uid), "roles": role_ids, "joined_at": "2024-01-01T00:00:00+00:00",
+            "deaf": False, "mute": False, "flags": 0, "nick": None}
+
+
+def presence_payload(uid):
+    return {"user": {"id": str(uid)}, "status": "online", "client_status": {"desktop": "online"},
+            "activities": [{"name": "Un jeu", "type": 0, "created_at": 0}]}
+
+
+def guild_payload(gid, bot_id):
+    roles = [{"id": str(gid), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+              "hoist": False, "managed": False, "mentionable": False}]
+    roles += [{"id": str(gid + r), "name": f"role{r}", "permissions": "0", "position": r, "color": 0,
+               "hoist": False, "managed": False, "mentionable": False} for r in range(1, 40)]
+    channels = [{"id": str(gid + 1000 + c), "type": 0, "name": f"salon-{c}", "position": c,
+                 "permission_overwrites": []} for c in range(50)]
+    emojis = [{"id": str(gid + 5000 + e), "name": f"emoji{e}", "roles": [], "require_colons": True,
+               "managed": False, "animated": False, "available": True} for e in range(50)]
+    return {"id": str(gid), "name": f"serveur {gid}", "member_count": 0, "large": True, "roles": roles,
+            "channels": channels, "emojis": emojis, "stickers": [], "features": [],
+            "members": [member_payload(bot_id, [])], "presences": [], "threads": [], "voice_states": []}
+
+
+def member_add_payload(gid, uid):
+    return dict(member_payload(uid, []), guild_id=str(gid))
+
+
+def message_payload(gid, channel_id, mid, author_id):
+    return {"id": str(mid), "channel_id": str(channel_id), "guild_id": str(gid), "author": user_payload(author_id),
+            "content": "!aide " + "x" * 40, "timestamp": "2024-01-01T00:00:00+00:00", "edited_timestamp": None,
+            "tts": False, "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [],
+            "embeds": [], "pinned": False, "type": 0}
+
+
+def child(guilds, members, joins):
+    """Exécuté dans un processus neuf, avec LEAN_MODE déjà positionné."""
+    sys.path.insert(0, ROOT)
+    import discord
+    import main
+
+    state = main.bot._connection
+    state.dispatch = lambda *args, **kwargs: None
+    bot_id = 1
+    state.user = discord.ClientUser(state=state, data={**user_payload(bot_id), "bot": True})
+    chunking = state._chunk_guilds
+    presences = state._intents.presences
+    gids = [(g + 1) << 32 for g in range(guilds)]
+
+    # payloads "reçus du gateway" (JSON brut), préparés hors chrono
+    raw_guilds = [json.dumps(guild_payload(gid, bot_id)) for gid in gids]
+    raw_chunks = {}
+    if chunking:
+        for gid in gids:
+            chunks = []
+            for start in range(0, members, CHUNK_SIZE):
+                ids = range(gid + 100_000 + start, gid + 100_000 + min(members, start + CHUNK_SIZE))
+                data = {"guild_id": str(gid), "members": [member_payload(uid, [str(gid + 1 + uid % 5)]) for uid in ids]}
+                if presences:
+                    data["presences"] = [presence_payload(uid) for uid in ids if uid % 3 == 0]
+                chunks.append(json.dumps(data))
+            raw_chunks[gid] = chunks
+    raw_messages = [json.dumps(message_payload(gid, gid + 1000 + m % 50, gid + 900_000 + m, gid + 100_000 + m))
+                    for gid in gids for m in range(MESSAGES_PER_GUILD)]
+    raw_joins = [json.dumps(member_add_payload(gid, gid + 10_000_000 + j)) for gid in gids for j in range(joins)]
+
+    rss_before = rss_kb()
+    start = time.perf_counter()
+    for raw in raw_guilds:
+        state._add_guild_from_data(json.loads(raw))
+    for gid, chunks in raw_chunks.items():
+        guild = state._get_guild(gid)
+        for raw in chunks:
+            data = json.loads(raw)
+            by_id = {}
+            for m in data["members"]:
+                member = discord.Member(data=m, guild=guild, state=state)
+                guild._add_member(member)
+                by_id[m["user"]["id"]] = member
+            for p in data.get("presences", []):
+                member = by_id.get(p["user"]["id"])
+                if member is not None:
+                    member._presence_update(discord.RawPresenceUpdateEvent(data=p, state=state), p["user"])
+        guild._member_count = members
+    startup = time.perf_counter() - start
+    for raw in raw_messages:
+        state.parse_message_create(json.loads(raw))
+    total = time.perf_counter() - start
+    rss_after = rss_kb()
+    members_before_joins = sum(len(g.members) for g in state.guilds)
+    for raw in raw_joins:
+        state.parse_guild_member_add(json.loads(raw))
+    rss_joins = rss_kb()
+
+    print(json.dumps({
+        "intents": main.bot.intents.value,
+        "startup": startup,
+        "total": total,
+        "rss_mb": (rss_after - rss_before) / 1024,
+        "members": members_before_joins,
+        "members_after_joins": sum(len(g.members) for g in state.guilds),
+        "joins_rss_mb": (rss_joins - rss_after) / 1024,
+        "messages": len(state._messages) if state._messages is not None else 0,
+        "emojis": len(state._emojis),
+        "users": len(state._users),
+    }))
+
+
+def run_mode(label, lean, guilds, members, joins):
+    env = dict(os.environ, LEAN_MODE="1" if lean else "0",
+               DB_NAME=os.path.join(tempfile.mkdtemp(prefix="bench_intents_"), "bench.sqlite"))
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", str(guilds), str(members), str(joins)],
+                         env=env, capture_output=True, text=True, check=True).stdout
+    r = json.loads(out.strip().splitlines()[-1])
+    print(f"{label:<8} intents={r['intents']:<8} démarrage={r['startup']:.2f}s (+messages {r['total']:.2f}s) "
+          f"RSS +{r['rss_mb']:.0f} Mo | membres={r['members']} users={r['users']} "
+          f"messages={r['messages']} emojis={r['emojis']}")
+    print(f"{'':<8} régime établi : +{r['members_after_joins'] - r['members']} membres en cache "
+          f"après {joins * guilds} joins (RSS +{r['joins_rss_mb']:.0f} Mo)")
+    return r
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))
+        sys.exit(0)
+    guilds = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    members = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    joins = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    print(f"{guilds} serveurs x {members} membres, {MESSAGES_PER_GUILD} messages et {joins} joins par serveur")
+    full = run_mode("complet", False, guilds, members, joins)
+    lean = run_mode("lean", True, guilds, members, joins)
+    print(f"gain: démarrage x{full['startup'] / max(lean['startup'], 1e-6):.0f}, "
+          f"mémoire -{full['rss_mb'] - lean['rss_mb']:.0f} Mo")
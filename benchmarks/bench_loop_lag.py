@@ -0,0 +1,130 @@
+# ============================================
+#  BENCHMARK LAG DE LA BOUCLE ASYNCIO
+#  Inonde les chemins qui touchent encore le disque et mesure le retard
+#  d'un "heartbeat" (tick de 5 ms) pendant le flood :
+#   - config : cache de config vidé, chaque event relit la config (miss)
+#   - snapshot : on_guild_role_update -> delta de snapshot (+ compaction)
+#   - warn : chemin de !warn (tampon, flush forcé, relecture des warns)
+#  Deux modes :
+#   - bloquant : helpers SQLite appelés directement dans la coroutine
+#   - thread DB : helpers exécutés via db_run (comportement actuel)
+#  Chaque requête SQL coûte en plus --disk-latency ms (trace sqlite3 qui
+#  dort dans le thread appelant), comme un disque lent / un fsync : en
+#  mode bloquant c'est la boucle qui dort. Le lag du mode "thread DB" doit
+#  rester loin sous celui du mode bloquant ; si les deux se rejoignent, un
+#  chemin disque est repassé sur la boucle.
+#
+#  Usage: python benchmarks/bench_loop_lag.py [nb_events] [--disk-latency MS]
+# ============================================
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(prefix="bench_lag_"), "bench.sqlite")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fakes import FakeGuild  # noqa: E402
+
+TICK = 0.005
+CONFIG_GUILDS = 200
+
+
+async def heartbeat(stop, lags):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def blocking_db_run(fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+
+def slow_disk(latency):
+    """Trace sqlite3 : chaque requête coûte `latency` secondes au thread qui l'exécute."""
+    def trace(statement):
+        time.sleep(latency)
+    return trace
+
+
+# ---------- Chemins disque ----------
+async def ev_config(guild, i):
+    guild_id = 1 + i % CONFIG_GUILDS
+    main.invalidate_config(guild_id)
+    await main.get_config(guild_id)
+
+
+async def ev_snapshot(guild, i):
+    role = guild.roles[1 + i % (len(guild.roles) - 1)]
+    role.name = f"role-{i}"
+    await main.on_guild_role_update(role, role)
+
+
+async def ev_warn(guild, i):
+    user_id = 500 + i % 20
+    await main.queue_warn(guild.id, user_id, 1, f"warn {i}")
+    await main.flush_pending_writes()
+    await main.db_run(main.get_warns_db, guild.id, user_id)
+
+
+PATHS = (("config", ev_config), ("snapshot", ev_snapshot), ("warn", ev_warn))
+
+
+async def flood(guild, fn, n):
+    stop = asyncio.Event()
+    lags = []
+    hb = asyncio.create_task(heartbeat(stop, lags))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    # quelques events en parallèle, comme le gateway en rafale
+    batch = 20
+    for i in range(0, n, batch):
+        await asyncio.gather(*(fn(guild, j) for j in range(i, min(n, i + batch))))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await hb
+    return elapsed, lags
+
+
+def report(label, n, elapsed, lags):
+    lags = sorted(lags) or [0.0]
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+    print(f"{label:<22} {n} events en {elapsed:.3f}s | ticks={len(lags)} "
+          f"lag max={lags[-1] * 1000:.1f}ms p99={p99 * 1000:.1f}ms")
+    return p99
+
+
+async def main_async(n, disk_latency):
+    main.init_db()
+    for guild_id in range(1, CONFIG_GUILDS + 1):
+        main.save_config(guild_id, dict(main.DEFAULT_CONFIG))
+    guild = FakeGuild(roles=50)
+    main.save_snapshot_db(guild.id, main.build_snapshot(guild))
+    main._snapshot_ready.add(guild.id)
+    main.db_connect().set_trace_callback(slow_disk(disk_latency))
+
+    real_db_run = main.db_run
+    worst = {}
+    for name, fn in PATHS:
+        for mode, runner in (("bloquant", blocking_db_run), ("thread DB", real_db_run)):
+            main.db_run = runner
+            elapsed, lags = await flood(guild, fn, n)
+            worst[(name, mode)] = report(f"{name} / {mode}", n, elapsed, lags)
+    main.db_run = real_db_run
+    for name, _ in PATHS:
+        ratio = worst[(name, "bloquant")] / max(worst[(name, "thread DB")], 1e-6)
+        print(f"{name:<10} lag p99 bloquant / thread DB = x{ratio:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lag de la boucle asyncio sur les chemins disque")
+    parser.add_argument("events", type=int, nargs="?", default=300, help="events par chemin et par mode")
+    parser.add_argument("--disk-latency", type=float, default=1.0, help="coût simulé d'une requête SQL (ms)")
+    args = parser.parse_args()
+    asyncio.run(main_async(args.events, args.disk_latency / 1000))
+    main.db_close()
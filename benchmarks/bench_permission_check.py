@@ -0,0 +1,59 @@
+# ============================================
+#  BENCHMARK CHECK DE PERMISSION
+#  is_staff / is_whitelisted : ancienne requête SQL + scan de liste
+#  comparée au set en mémoire de main.py.
+#
+#  Usage: python benchmarks/bench_permission_check.py [nb_checks]
+# ============================================
+
+import os
+import sys
+import time
+import tempfile
+from types import SimpleNamespace
+
+os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(prefix="bench_perm_"), "bench.sqlite")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+GUILDS = 50
+WHITELIST_SIZE = 40
+
+
+def legacy_is_staff(ctx):
+    # ancien chemin : SELECT de la whitelist puis `in` sur une liste
+    if ctx.author.id == main.OWNER_ID:
+        return True
+    rows = main.db_fetchall("SELECT user_id FROM whitelist WHERE guild_id=?", (ctx.guild.id,))
+    return ctx.author.id in [r[0] for r in rows]
+
+
+def run(label, fn, contexts):
+    start = time.perf_counter()
+    allowed = 0
+    for ctx in contexts:
+        allowed += fn(ctx)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {len(contexts)} checks en {elapsed:.3f}s  ->  "
+          f"{len(contexts) / elapsed:,.0f} checks/s ({elapsed / len(contexts) * 1e6:.2f} µs/check, {allowed} autorisés)")
+    return elapsed
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    main.init_db()
+    with main.db_batch():
+        for g in range(GUILDS):
+            for u in range(WHITELIST_SIZE):
+                main.add_whitelist(g, 1000 + u)
+    main.load_whitelists()
+
+    contexts = [
+        SimpleNamespace(guild=SimpleNamespace(id=i % GUILDS), author=SimpleNamespace(id=1000 + (i % (WHITELIST_SIZE * 2))))
+        for i in range(n)
+    ]
+    before = run("avant (SQL + liste)", legacy_is_staff, contexts)
+    after = run("après (set mémoire)", main.is_staff, contexts)
+    print(f"gain: x{before / after:.0f}")
+    main.db_close()
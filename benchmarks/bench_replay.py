@@ -0,0 +1,284 @@
+# ============================================
+#  HARNESS DE REPLAY (sans Discord)
+#  Rejoue des scénarios de raid / nuke à travers les vrais handlers de
+#  main.py (on_member_join, on_member_ban, on_guild_channel_delete,
+#  on_guild_role_delete, on_audit_log_entry_create -> check_and_handle_nuke,
+#  send_log) avec les faux objets de benchmarks/fakes.py.
+#
+#  Pour chaque scénario : débit (events/s), latence p50/p99 des handlers,
+#  requêtes SQL par event (trace de la connexion partagée), appels REST
+#  simulés par event et DM envoyés à l'owner (digest de notify_owner).
+#
+#  Usage:
+#    python benchmarks/bench_replay.py [--scale N] [--rest-latency MS]
+#    python benchmarks/bench_replay.py --replay events.jsonl [--speed X]
+#
+#  Format d'un replay (une ligne JSON par event, "t" = secondes depuis le début) :
+#    {"t": 0.01, "type": "member_join", "user_id": 1}
+#    {"t": 0.02, "type": "channel_delete", "executor_id": 2}
+#    {"t": 0.03, "type": "role_delete", "executor_id": 2}
+#    {"t": 0.04, "type": "member_ban", "user_id": 3, "executor_id": 2}
+#    {"t": 0.05, "type": "command", "user_id": 4, "command": "warns"}
+#    {"t": 0.06, "type": "owner_alert", "severity": "critical", "text": "..."}
+# ============================================
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(prefix="bench_replay_"), "bench.sqlite")
+os.environ.setdefault("AUDIT_FALLBACK_DELAY", "0.05")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord  # noqa: E402
+
+import main  # noqa: E402
+from fakes import FakeGuild, FakeMember, FakeUser, RestCounter, audit_entry  # noqa: E402
+
+
+class OwnerStub:
+    """bot.fetch_user factice : compte les résolutions et les appels REST côté DM owner."""
+
+    def __init__(self, rest):
+        self.rest = rest
+        self.fetches = 0
+
+    async def fetch_user(self, user_id):
+        if user_id == main.OWNER_ID:
+            self.fetches += 1
+        return FakeUser(user_id, rest=self.rest)
+
+    @property
+    def dms(self):
+        return self.rest.calls.get("dm.send", 0)
+
+
+class SqlCounter:
+    """Compte les requêtes exécutées sur la connexion partagée (trace sqlite3)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement):
+        self.count += 1
+
+    def install(self):
+        main.db_connect().set_trace_callback(self)
+
+
+# ---------- Mise en place ----------
+def make_guild(rest, members=50, **cfg_overrides):
+    guild = FakeGuild(rest=rest)
+    for _ in range(members):
+        guild.add_member(FakeMember(guild))
+    cfg = dict(main.DEFAULT_CONFIG)
+    cfg["log_channel"] = guild.log_channel.id
+    cfg.update(cfg_overrides)
+    main.save_config(guild.id, cfg)
+    return guild
+
+
+def reset_state():
+    main.join_windows.clear()
+    main.lockdowns.clear()
+    main.action_trackers.clear()
+
+
+async def settle(guild):
+    """Attend la fin des tâches de fond (fallback audit, logs, tampon d'écriture)."""
+    await asyncio.sleep(main.AUDIT_FALLBACK_DELAY * 2)
+    task = main._log_flush_tasks.pop(guild.id, None)
+    if task:
+        task.cancel()
+    await main.flush_command_audit()
+    await main.flush_logs(guild)
+    await main.flush_pending_writes()
+    task = main._owner_flush_task
+    if task and not task.done():
+        task.cancel()
+    await main.flush_owner_alerts()
+
+
+# ---------- Events élémentaires ----------
+async def ev_member_join(guild, user_id=None, **_):
+    member = FakeMember(guild, user_id)
+    guild.add_member(member)
+    await main.on_member_join(member)
+
+
+async def ev_channel_delete(guild, executor_id, **_):
+    channel = guild.channels.pop() if len(guild.channels) > 1 else guild.log_channel
+    await main.on_guild_channel_delete(channel)
+    entry = audit_entry(guild, discord.AuditLogAction.channel_delete, channel.id, executor_id,
+                        before=type("Before", (), {"name": channel.name})())
+    await main.on_audit_log_entry_create(entry)
+
+
+async def ev_role_delete(guild, executor_id, **_):
+    role = guild.roles.pop() if len(guild.roles) > 1 else guild.default_role
+    await main.on_guild_role_delete(role)
+    entry = audit_entry(guild, discord.AuditLogAction.role_delete, role.id, executor_id,
+                        before=type("Before", (), {"name": role.name})())
+    await main.on_audit_log_entry_create(entry)
+
+
+async def ev_member_ban(guild, executor_id, user_id=None, **_):
+    user = guild.members.pop(user_id, None) if user_id else None
+    user = user or FakeUser(user_id or len(guild.banned) + 1)
+    guild.banned.add(user.id)
+    await main.on_member_ban(guild, user)
+    entry = audit_entry(guild, discord.AuditLogAction.ban, user.id, executor_id)
+    await main.on_audit_log_entry_create(entry)
+
+
+async def ev_command(guild, user_id=None, command="aide", **_):
+    member = guild.get_member(user_id) or guild.add_member(FakeMember(guild, user_id))
+    cmd = main.bot.get_command(command)
+    ctx = SimpleNamespace(guild=guild, author=member, channel=guild.log_channel, command=cmd, send=guild.log_channel.send)
+    await main.global_command_check(ctx)
+
+
+async def ev_log(guild, i=0, **_):
+    await main.send_log(guild, f"ligne de log {i}")
+
+
+async def ev_owner_alert(guild, severity="warning", text="alerte", **_):
+    main.notify_owner(text, severity)
+
+
+EVENTS = {
+    "member_join": ev_member_join,
+    "channel_delete": ev_channel_delete,
+    "role_delete": ev_role_delete,
+    "member_ban": ev_member_ban,
+    "log": ev_log,
+    "command": ev_command,
+    "owner_alert": ev_owner_alert,
+}
+
+
+# ---------- Exécution + métriques ----------
+async def run_scenario(label, guild, events, sql, owner, burst=1, speed=None):
+    """
+    events: liste de (t, type, kwargs). burst > 1 dispatch les events par
+    paquets concurrents (rafale gateway) ; speed respecte les offsets "t".
+    """
+    reset_state()
+    sql_before = sql.count
+    rest_before = guild.rest.total
+    contained_before = main.containment_stats["contained"]
+    dms_before = owner.dms
+    latencies = []
+
+    async def timed(kind, kwargs):
+        start = time.perf_counter()
+        await EVENTS[kind](guild, **kwargs)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(0, len(events), burst):
+        batch = events[i:i + burst]
+        if speed:
+            delay = batch[0][0] / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await asyncio.gather(*(timed(kind, kwargs) for _, kind, kwargs in batch))
+    elapsed = time.perf_counter() - start
+    await settle(guild)
+
+    n = len(events)
+    p50, p99, worst = main.latency_summary(latencies)
+    print(f"{label:<18} {n:>6} events en {elapsed:.3f}s -> {n / elapsed:>9,.0f} events/s | "
+          f"handler p50={p50 * 1000:.2f}ms p99={p99 * 1000:.2f}ms max={worst * 1000:.2f}ms | "
+          f"SQL/event={(sql.count - sql_before) / n:.2f} REST/event={(guild.rest.total - rest_before) / n:.2f} | "
+          f"bans={len(guild.banned)} confinés={main.containment_stats['contained'] - contained_before} "
+          f"DM owner={owner.dms - dms_before}")
+    return {"events": n, "elapsed": elapsed, "p50": p50, "p99": p99}
+
+
+def raid_events(n):
+    return [(0, "member_join", {}) for _ in range(n)]
+
+
+def nuke_events(attackers, actions):
+    events = []
+    kinds = ("channel_delete", "role_delete", "member_ban")
+    for a in range(attackers):
+        executor_id = 900_000 + a
+        for i in range(actions):
+            events.append((0, kinds[i % len(kinds)], {"executor_id": executor_id}))
+    return events
+
+
+def command_events(n, user_id):
+    return [(0, "command", {"command": ("aide", "warns")[i % 2], "user_id": user_id}) for i in range(n)]
+
+
+def log_events(n):
+    return [(0, "log", {"i": i}) for i in range(n)]
+
+
+def owner_alert_events(n):
+    severities = tuple(main.SEVERITIES)
+    return [(0, "owner_alert", {"severity": severities[i % len(severities)], "text": f"alerte {i}"}) for i in range(n)]
+
+
+def load_replay(path):
+    events = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            ev = json.loads(line)
+            kind = ev.pop("type")
+            if kind not in EVENTS:
+                raise SystemExit(f"type d'event inconnu: {kind}")
+            events.append((float(ev.pop("t", 0)), kind, ev))
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+async def main_async(args):
+    main.init_db()
+    main.load_whitelists()
+    sql = SqlCounter()
+    sql.install()
+    rest = lambda: RestCounter(args.rest_latency / 1000)  # noqa: E731
+    owner = OwnerStub(rest())
+    main.bot.fetch_user = owner.fetch_user
+
+    if args.replay:
+        events = load_replay(args.replay)
+        guild = make_guild(rest(), members=200, antiraid=True)
+        await run_scenario(os.path.basename(args.replay), guild, events, sql, owner, speed=args.speed)
+        print(f"owner: {owner.fetches} résolution(s), REST DM {owner.rest.calls}")
+        return
+
+    s = args.scale
+    await run_scenario("raid (rafales)", make_guild(rest(), antiraid=True), raid_events(500 * s), sql, owner, burst=50)
+    await run_scenario("raid (séquentiel)", make_guild(rest(), antiraid=True), raid_events(500 * s), sql, owner)
+    await run_scenario("nuke", make_guild(rest(), channels=40 * s, roles=40 * s), nuke_events(10 * s, 6), sql, owner)
+    await run_scenario("nuke (rafales)", make_guild(rest(), channels=40 * s, roles=40 * s), nuke_events(10 * s, 6), sql, owner, burst=20)
+    await run_scenario("send_log", make_guild(rest()), log_events(5000 * s), sql, owner)
+    guild = make_guild(rest())
+    staff = guild.add_member(FakeMember(guild))
+    main.add_whitelist(guild.id, staff.id)
+    await run_scenario("commandes", guild, command_events(2000 * s, staff.id), sql, owner)
+    await run_scenario("alertes owner", make_guild(rest()), owner_alert_events(600 * s), sql, owner)
+    print(f"owner: {owner.fetches} résolution(s), REST DM {owner.rest.calls}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay de scénarios raid / nuke sans Discord")
+    parser.add_argument("--scale", type=int, default=1, help="multiplie la taille des scénarios")
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="latence simulée des appels REST (ms)")
+    parser.add_argument("--replay", help="fichier JSONL d'events enregistrés")
+    parser.add_argument("--speed", type=float, default=None, help="rejoue les offsets 't' (1.0 = temps réel)")
+    asyncio.run(main_async(parser.parse_args()))
+    main.db_close()
@@ -0,0 +1,109 @@
+# ============================================
+#  BENCHMARK STOCKAGE
+#  Compare l'ancien modèle "une connexion par appel" avec la
+#  connexion partagée (WAL) de main.py.
+#
+#  Usage: python benchmarks/bench_storage.py [nb_events]
+# ============================================
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import asyncio
+import tempfile
+
+TMP_DIR = tempfile.mkdtemp(prefix="bench_storage_")
+os.environ["DB_NAME"] = os.path.join(TMP_DIR, "after.sqlite")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+GUILDS = 20
+
+
+# ---------- AVANT : une connexion sqlite3 par helper ----------
+def legacy_setup(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS guild_config (guild_id INTEGER PRIMARY KEY, config_json TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS whitelist (guild_id INTEGER, user_id INTEGER, PRIMARY KEY (guild_id, user_id))")
+    for g in range(GUILDS):
+        conn.execute("INSERT OR REPLACE INTO guild_config VALUES (?, ?)", (g, json.dumps(main.DEFAULT_CONFIG)))
+    conn.commit()
+    conn.close()
+
+
+def legacy_event(path, guild_id, user_id, i):
+    # load_config
+    conn = sqlite3.connect(path)
+    row = conn.execute("SELECT config_json FROM guild_config WHERE guild_id=?", (guild_id,)).fetchone()
+    conn.close()
+    json.loads(row[0])
+    # is_whitelisted
+    conn = sqlite3.connect(path)
+    conn.execute("SELECT 1 FROM whitelist WHERE guild_id=? AND user_id=?", (guild_id, user_id)).fetchone()
+    conn.close()
+    # ancien persist_log_event (ensure_logs_table + insert)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS logs (id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, event_type TEXT, event_json TEXT, timestamp INTEGER)")
+    conn.commit()
+    conn.close()
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO logs (guild_id, event_type, event_json, timestamp) VALUES (?, ?, ?, ?)",
+                 (guild_id, "member_join", json.dumps({"user_id": user_id, "i": i}), int(time.time())))
+    conn.commit()
+    conn.close()
+
+
+# ---------- APRÈS : helpers de main.py ----------
+def shared_setup():
+    main.init_db()
+    for g in range(GUILDS):
+        main.save_config(g, main.DEFAULT_CONFIG)
+
+
+def shared_event(guild_id, user_id, i):
+    main.load_config(guild_id)
+    main.is_whitelisted(guild_id, user_id)
+    main.db_write(main.LOG_INSERT_SQL, (guild_id, "member_join", json.dumps({"user_id": user_id, "i": i}), main.ts()))
+
+
+async def group_commit_run(n):
+    # chemin async des handlers : config en cache, whitelist en mémoire, log en tampon
+    for i in range(n):
+        guild_id = i % GUILDS
+        await main.get_config(guild_id)
+        main.is_whitelisted(guild_id, 1000 + i)
+        await main.queue_log_event(guild_id, "member_join", {"user_id": 1000 + i, "i": i})
+    await main.flush_pending_writes()
+
+
+def run_async(label, n):
+    start = time.perf_counter()
+    asyncio.run(group_commit_run(n))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {n} events en {elapsed:.3f}s  ->  {n / elapsed:,.0f} events/s")
+    return n / elapsed
+
+
+def run(label, fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i % GUILDS, 1000 + i, i)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {n} events en {elapsed:.3f}s  ->  {n / elapsed:,.0f} events/s")
+    return n / elapsed
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    legacy_path = os.path.join(TMP_DIR, "before.sqlite")
+    legacy_setup(legacy_path)
+    shared_setup()
+
+    before = run("avant (connexion/appel)", lambda g, u, i: legacy_event(legacy_path, g, u, i), n)
+    after = run("après (connexion partagée)", shared_event, n)
+    grouped = run_async("après (group commit)", n * 10)
+    print(f"gain: x{after / before:.1f} (connexion partagée), x{grouped / before:.1f} (group commit)")
+    main.db_close()
@@ -0,0 +1,236 @@
+# ============================================
+#  FAUX OBJETS DISCORD
+#  Remplaçants minimaux des modèles discord.py (Guild, Member, User, Role,
+#  TextChannel, DMChannel, AuditLogEntry) pour rejouer des scénarios à
+#  travers les vrais handlers de main.py, sans connexion à Discord.
+#  Chaque appel "REST" est compté et peut simuler une latence réseau.
+# ============================================
+
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+import discord
+
+_ids = itertools.count(10_000_000)
+
+
+def next_id():
+    return next(_ids)
+
+
+class RestCounter:
+    """Compte les appels REST simulés et applique une latence fixe."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+
+    async def hit(self, route):
+        self.calls[route] = self.calls.get(route, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    @property
+    def total(self):
+        return sum(self.calls.values())
+
+
+class FakePermissions:
+    def __init__(self, value=0):
+        self.value = value
+        self.administrator = bool(value & 0x8)
+        self.manage_guild = bool(value & 0x20)
+        self.manage_roles = bool(value & 0x10000000)
+        self.ban_members = bool(value & 0x4)
+        self.kick_members = bool(value & 0x2)
+        self.send_messages = True
+
+
+class FakeRole:
+    def __init__(self, guild, name, permissions=0, position=0, role_id=None):
+        self.guild = guild
+        self.id = role_id or next_id()
+        self.name = name
+        self.permissions = FakePermissions(permissions)
+        self.color = SimpleNamespace(value=0)
+        self.hoist = False
+        self.mentionable = False
+        self.position = position
+        self.managed = False
+        self.members = []
+
+    def is_default(self):
+        return self.id == self.guild.id
+
+    def __ge__(self, other):
+        return self.position >= other.position
+
+    def __str__(self):
+        return self.name
+
+
+class FakeDMChannel:
+    def __init__(self, user, rest=None):
+        self.id = next_id()
+        self.recipient = user
+        self._rest = rest
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        if self._rest:
+            await self._rest.hit("dm.send")
+        self.sent += 1
+
+
+class FakeUser:
+    def __init__(self, user_id, name=None, rest=None):
+        self.id = user_id
+        self.name = name or f"user{user_id}"
+        self.display_name = self.name
+        self.mention = f"<@{user_id}>"
+        self.bot = False
+        self.dm_channel = None
+        self._rest = rest
+
+    async def create_dm(self):
+        if self._rest:
+            await self._rest.hit("user.create_dm")
+        self.dm_channel = FakeDMChannel(self, self._rest)
+        return self.dm_channel
+
+    async def send(self, content=None, **kwargs):
+        channel = self.dm_channel or await self.create_dm()
+        await channel.send(content, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMember(FakeUser):
+    def __init__(self, guild, user_id=None, roles=None):
+        super().__init__(user_id or next_id(), rest=guild.rest)
+        self.guild = guild
+        self.roles = [guild.default_role] + list(roles or [])
+        self.top_role = self.roles[-1]
+
+    async def ban(self, reason=None):
+        await self.guild.ban(self, reason=reason)
+
+    async def edit(self, roles=None, reason=None):
+        await self.guild.rest.hit("member.edit")
+        self.roles = [self.guild.default_role] + list(roles or [])
+
+    async def add_roles(self, *roles, reason=None):
+        await self.guild.rest.hit("member.add_roles")
+
+    async def remove_roles(self, *roles, reason=None):
+        await self.guild.rest.hit("member.remove_roles")
+
+
+class FakeTextChannel:
+    def __init__(self, guild, name, position=0, channel_id=None):
+        self.guild = guild
+        self.id = channel_id or next_id()
+        self.name = name
+        self.type = discord.ChannelType.text
+        self.category = None
+        self.category_id = None
+        self.position = position
+        self.topic = None
+        self.nsfw = False
+        self.slowmode_delay = 0
+        self.overwrites = {}
+        self.mention = f"<#{self.id}>"
+        self.sent = 0
+
+    def permissions_for(self, member):
+        return FakePermissions(0x800)
+
+    async def send(self, content=None, **kwargs):
+        await self.guild.rest.hit("channel.send")
+        self.sent += 1
+
+    async def create_invite(self, **kwargs):
+        await self.guild.rest.hit("channel.create_invite")
+        return SimpleNamespace(url="https://discord.gg/fake")
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, name="bench", rest=None, channels=10, roles=5):
+        self.id = next_id()
+        self.name = name
+        self.rest = rest or RestCounter()
+        self.default_role = FakeRole(self, "@everyone", role_id=self.id)
+        self.roles = [self.default_role] + [FakeRole(self, f"role{i}", position=i + 1) for i in range(roles)]
+        self.channels = [FakeTextChannel(self, f"salon-{i}", position=i) for i in range(channels)]
+        self.text_channels = self.channels
+        self.members = {}
+        self.me = None
+        self.system_channel = None
+        self.bitrate_limit = 96000
+        self.filesize_limit = 10 * 1024 * 1024
+        self.member_count = 0
+        self.banned = set()
+        self.audit_entries = []
+
+    @property
+    def log_channel(self):
+        return self.channels[0]
+
+    def get_channel(self, channel_id):
+        for ch in self.channels:
+            if ch.id == channel_id:
+                return ch
+        return None
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+    def add_member(self, member):
+        self.members[member.id] = member
+        self.member_count = len(self.members)
+        return member
+
+    async def ban(self, user, reason=None, **kwargs):
+        await self.rest.hit("guild.ban")
+        self.banned.add(user.id)
+
+    async def unban(self, user, reason=None):
+        await self.rest.hit("guild.unban")
+        self.banned.discard(user.id)
+
+    def audit_logs(self, limit=100, action=None, **kwargs):
+        guild = self
+
+        async def gen():
+            await guild.rest.hit("guild.audit_logs")
+            count = 0
+            for entry in reversed(guild.audit_entries):
+                if action is None or entry.action == action:
+                    yield entry
+                    count += 1
+                    if count >= limit:
+                        return
+
+        return gen()
+
+
+def audit_entry(guild, action, target_id, executor_id, before=None, after=None):
+    """Entrée d'audit log telle que livrée par on_audit_log_entry_create."""
+    entry = SimpleNamespace(
+        id=next_id(),
+        guild=guild,
+        action=action,
+        target=discord.Object(id=target_id),
+        user_id=executor_id,
+        user=guild.get_member(executor_id),
+        before=before or SimpleNamespace(),
+        after=after or SimpleNamespace(),
+        created_at=discord.utils.utcnow(),
+    )
+    guild.audit_entries.append(entry)
+    return entry
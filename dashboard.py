@@ -1,67 +1,472 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
 import uvicorn
 import threading
 import requests
 import json
+import sqlite3
+import time
+import random
+import asyncio
 import discord
 from discord.ext import commands
 import os
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 OWNER_ID = 906909345072164884
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix="!", intents=intents)
+# LEAN_MODE=1 : le dashboard ne fait que bannir / débannir, il suffit des
+# intents serveurs + modération, sans cache de membres ni de messages.
+LEAN_MODE = os.getenv("LEAN_MODE", "0") == "1"
+if LEAN_MODE:
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.moderation = True
+    bot = commands.Bot(command_prefix="!", intents=intents,
+                       member_cache_flags=discord.MemberCacheFlags.none(),
+                       chunk_guilds_at_startup=False, max_messages=None)
+else:
+    intents = discord.Intents.all()
+    bot = commands.Bot(command_prefix="!", intents=intents)
+
+# ----------------------------------------------------------
+# LEDGER DE SYNCHRONISATION (SQLite)
+# ----------------------------------------------------------
+# Une ligne par (user_id, action) : un nouvel envoi remplace le précédent
+# (dernier écrivain gagnant) et reçoit un numéro de séquence croissant.
+# Un ban efface l'unban en attente du même utilisateur et inversement.
+# Chaque serveur garde un curseur (dernière séquence traitée) et ne
+# rejoue que les entrées plus récentes. Une entrée qui échoue sur un serveur
+# (403, erreurs temporaires épuisées) est notée dans sync_failures et
+# retentée au passage suivant (on_guild_available, nouvelle sync), au plus
+# SYNC_MAX_ATTEMPTS fois.
+SYNC_DB = os.getenv("SYNC_DB", "dashboard_sync.sqlite")
+SYNC_ACTIONS = {"ban": "unban", "unban": "ban"}  # action -> action opposée
+SYNC_BATCH = 500
+SYNC_MAX_ATTEMPTS = 10
+
+_db_conn = None
+_db_lock = threading.Lock()
+
+
+def db_connect():
+    global _db_conn
+    if _db_conn is None:
+        conn = sqlite3.connect(SYNC_DB, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_ledger (
+                user_id INTEGER,
+                action TEXT,
+                seq INTEGER,
+                payload TEXT,
+                updated_at INTEGER,
+                PRIMARY KEY (user_id, action)
+            )
+        """)
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_sync_ledger_seq ON sync_ledger (seq)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_cursors (
+                guild_id INTEGER PRIMARY KEY,
+                seq INTEGER
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_failures (
+                guild_id INTEGER,
+                seq INTEGER,
+                attempts INTEGER,
+                error TEXT,
+                updated_at INTEGER,
+                PRIMARY KEY (guild_id, seq)
+            )
+        """)
+        conn.commit()
+        _db_conn = conn
+    return _db_conn
+
+
+def record_sync_many(entries):
+    """
+    Enregistre [(user_id, action, payload)] dans une seule transaction
+    (remplace l'entrée précédente pour ce user / cette action). Retourne la
+    dernière séquence attribuée.
+    """
+    with _db_lock:
+        conn = db_connect()
+        with conn:
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM sync_ledger").fetchone()[0]
+            now = int(time.time())
+            for user_id, action, payload in entries:
+                seq += 1
+                conn.execute("DELETE FROM sync_ledger WHERE user_id=? AND action=?", (user_id, SYNC_ACTIONS[action]))
+                conn.execute(
+                    "INSERT OR REPLACE INTO sync_ledger (user_id, action, seq, payload, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (user_id, action, seq, json.dumps(payload), now)
+                )
+        return seq
+
+
+def record_sync(user_id, action, payload):
+    """Enregistre une entrée. Retourne sa séquence."""
+    return record_sync_many([(user_id, action, payload)])
+
+
+def pending_sync(guild_id, limit=SYNC_BATCH):
+    """Entrées plus récentes que le curseur du serveur : [(seq, user_id, action)]."""
+    with _db_lock:
+        conn = db_connect()
+        row = conn.execute("SELECT seq FROM sync_cursors WHERE guild_id=?", (guild_id,)).fetchone()
+        return conn.execute(
+            "SELECT seq, user_id, action FROM sync_ledger WHERE seq > ? ORDER BY seq LIMIT ?",
+            (row[0] if row else 0, limit)
+        ).fetchall()
+
+
+def failed_sync(guild_id):
+    """Entrées en échec à retenter sur ce serveur (toujours présentes dans le ledger) : [(seq, user_id, action)]."""
+    with _db_lock:
+        conn = db_connect()
+        with conn:
+            # entrées remplacées depuis (ban puis unban, ...) : plus rien à retenter
+            conn.execute("DELETE FROM sync_failures WHERE guild_id=? AND seq NOT IN (SELECT seq FROM sync_ledger)",
+                         (guild_id,))
+        return conn.execute(
+            "SELECT l.seq, l.user_id, l.action FROM sync_failures f JOIN sync_ledger l ON l.seq = f.seq "
+            "WHERE f.guild_id=? AND f.attempts < ? ORDER BY l.seq",
+            (guild_id, SYNC_MAX_ATTEMPTS)
+        ).fetchall()
+
+
+def record_sync_results(guild_id, cursor, done_seqs, failures):
+    """
+    Résultat d'un lot sur un serveur, dans une transaction : avance le
+    curseur (si cursor n'est pas None), oublie les échecs des entrées
+    appliquées et note les nouveaux échecs failures = {seq: erreur}.
+    """
+    with _db_lock:
+        conn = db_connect()
+        with conn:
+            if cursor is not None:
+                conn.execute(
+                    "INSERT INTO sync_cursors (guild_id, seq) VALUES (?, ?) "
+                    "ON CONFLICT(guild_id) DO UPDATE SET seq = MAX(seq, excluded.seq)",
+                    (guild_id, cursor)
+                )
+            conn.executemany("DELETE FROM sync_failures WHERE guild_id=? AND seq=?",
+                             [(guild_id, seq) for seq in done_seqs])
+            now = int(time.time())
+            conn.executemany(
+                "INSERT INTO sync_failures (guild_id, seq, attempts, error, updated_at) VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT(guild_id, seq) DO UPDATE SET attempts = attempts + 1, error = excluded.error, "
+                "updated_at = excluded.updated_at",
+                [(guild_id, seq, error, now) for seq, error in failures.items()]
+            )
+
+
+def sync_count():
+    with _db_lock:
+        return db_connect().execute("SELECT COUNT(*) FROM sync_ledger").fetchone()[0]
+
+
+def count_guilds_synced(guild_ids, seq):
+    """
+    (synchronisés, en échec) parmi guild_ids : curseur ayant atteint seq et
+    aucune entrée <= seq en échec / au moins une entrée <= seq en échec.
+    """
+    with _db_lock:
+        conn = db_connect()
+        reached = {row[0] for row in conn.execute("SELECT guild_id FROM sync_cursors WHERE seq >= ?", (seq,))}
+        failing = {row[0] for row in conn.execute(
+            "SELECT DISTINCT guild_id FROM sync_failures WHERE seq <= ? AND seq IN (SELECT seq FROM sync_ledger)", (seq,))}
+    synced = sum(1 for guild_id in guild_ids if guild_id in reached and guild_id not in failing)
+    return synced, sum(1 for guild_id in guild_ids if guild_id in failing)
+
 
 # ----------------------------------------------------------
 # API FASTAPI
 # ----------------------------------------------------------
+# L'API et le bot tournent sur la même boucle asyncio : le bot est lancé
+# par le lifespan de l'app (uvicorn dashboard:app ou python dashboard.py).
+# Une sync est enregistrée dans le ledger puis propagée tout de suite à tous
+# les serveurs ; la réponse donne la séquence à suivre sur
+# GET /api/sync/{seq} (résultat asynchrone).
+SYNC_BULK_MAX = 10000
+
+
+@asynccontextmanager
+async def lifespan(app):
+    bot_task = None
+    if BOT_TOKEN:
+        bot_task = asyncio.create_task(bot.start(BOT_TOKEN))
+        bot_task.add_done_callback(_report_bot_exit)
+    try:
+        yield
+    finally:
+        if bot_task is not None:
+            await bot.close()
+            await asyncio.gather(bot_task, return_exceptions=True)
+
+
+def _report_bot_exit(task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[BOT] arrêté: {task.exception()!r}")
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
-# stockage local des bans synchronisés
-sync_queue = []
+
+def parse_user_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"user_id invalide: {value!r}")
+
+
+def check_action(action):
+    if action not in SYNC_ACTIONS:
+        raise HTTPException(status_code=400, detail="action doit être 'ban' ou 'unban'")
+
+
+def propagate_to_all_guilds():
+    for guild in bot.guilds:
+        schedule_propagation(guild.id)
 
 
 @app.get("/")
-def home():
-    return {"status": "Dashboard en ligne", "sync_count": len(sync_queue)}
+async def home():
+    return {"status": "Dashboard en ligne", "sync_count": await asyncio.to_thread(sync_count)}
+
+
+@app.get("/api/sync/status")
+async def sync_status():
+    return propagation_progress()
+
 
+@app.get("/api/sync/{seq}")
+async def sync_result(seq: int):
+    """Avancement d'une sync : serveurs dont le curseur a atteint cette séquence."""
+    guild_ids = [guild.id for guild in bot.guilds]
+    synced, failed = await asyncio.to_thread(count_guilds_synced, guild_ids, seq)
+    return {"seq": seq, "guilds_total": len(guild_ids), "guilds_synced": synced, "guilds_failed": failed,
+            "done": synced == len(guild_ids), "progress": propagation_progress()}
 
-@app.post("/api/sync")
-def receive_sync(data: dict):
-    sync_queue.append(data)
-    return {"status": "Sync reçue", "data": data}
+
+@app.post("/api/sync", status_code=202)
+async def receive_sync(data: dict):
+    user_id = parse_user_id(data.get("user_id"))
+    check_action(data.get("action"))
+    seq = await asyncio.to_thread(record_sync, user_id, data["action"], data)
+    propagate_to_all_guilds()
+    return {"status": "Sync reçue", "seq": seq, "result": f"/api/sync/{seq}", "data": data}
+
+
+@app.post("/api/sync/bulk", status_code=202)
+async def receive_sync_bulk(data: dict):
+    """{"action": "ban", "user_ids": [...], "reason": "..."} - jusqu'à SYNC_BULK_MAX ids."""
+    check_action(data.get("action"))
+    user_ids = data.get("user_ids")
+    if not isinstance(user_ids, list) or not user_ids:
+        raise HTTPException(status_code=400, detail="user_ids doit être une liste non vide")
+    if len(user_ids) > SYNC_BULK_MAX:
+        raise HTTPException(status_code=413, detail=f"{SYNC_BULK_MAX} ids maximum par requête")
+    ids = list(dict.fromkeys(parse_user_id(u) for u in user_ids))
+    payload = {"action": data["action"], "reason": data.get("reason")}
+    seq = await asyncio.to_thread(record_sync_many, [(u, data["action"], {**payload, "user_id": u}) for u in ids])
+    propagate_to_all_guilds()
+    return {"status": "Sync reçue", "count": len(ids), "seq": seq, "result": f"/api/sync/{seq}"}
 
 
 # ----------------------------------------------------------
-# Thread bot Discord
+# PROPAGATION DES BANS (worker)
 # ----------------------------------------------------------
+# Les serveurs à synchroniser passent par une file traitée par
+# PROPAGATION_GUILDS workers en parallèle. Dans un serveur (un seul bucket de
+# rate limit pour les bans), les bans partent par lots de BULK_BAN_SIZE via
+# bulk_ban, sinon un par un avec au plus PROPAGATION_PER_GUILD requêtes
+# simultanées. Ban par discord.Object(id) : aucun fetch_user. Les erreurs
+# temporaires (5xx, 429 trop long, réseau) sont retentées avec backoff
+# exponentiel ; les refus (403) et les unbans d'utilisateurs non bannis ne le
+# sont pas.
+PROPAGATION_GUILDS = int(os.getenv("PROPAGATION_GUILDS", "8"))
+PROPAGATION_PER_GUILD = 2
+PROPAGATION_RETRIES = 4
+PROPAGATION_BACKOFF = 1.0
+BULK_BAN_SIZE = 200
+
+_propagation_queue = None
+_queued_guilds = set()   # en file
+_active_guilds = set()   # en cours de traitement
+_rerun_guilds = set()    # nouvelles entrées arrivées pendant le traitement
+propagation_stats = {
+    "guilds_queued": 0, "guilds_done": 0, "banned": 0, "unbanned": 0,
+    "failed": 0, "retries": 0, "started_at": None,
+}
+
+
+def propagation_progress():
+    stats = dict(propagation_stats)
+    elapsed = time.time() - stats["started_at"] if stats["started_at"] else 0
+    applied = stats["banned"] + stats["unbanned"]
+    stats["pending_guilds"] = len(_queued_guilds) + len(_active_guilds)
+    stats["actions_per_sec"] = round(applied / elapsed, 1) if elapsed else 0.0
+    return stats
+
+
+def schedule_propagation(guild_id):
+    """Ajoute un serveur à la file de propagation (une seule fois tant qu'il y est)."""
+    if _propagation_queue is None or guild_id in _queued_guilds:
+        return
+    if guild_id in _active_guilds:
+        _rerun_guilds.add(guild_id)  # repassera juste après, jamais deux workers sur un serveur
+        return
+    _queued_guilds.add(guild_id)
+    propagation_stats["guilds_queued"] += 1
+    if propagation_stats["started_at"] is None:
+        propagation_stats["started_at"] = time.time()
+    _propagation_queue.put_nowait(guild_id)
+
+
+async def with_retries(fn, *args, **kwargs):
+    delay = PROPAGATION_BACKOFF
+    for attempt in range(PROPAGATION_RETRIES + 1):
+        try:
+            return await fn(*args, **kwargs)
+        except discord.RateLimited as e:
+            wait = e.retry_after
+        except discord.HTTPException as e:
+            if e.status < 500 and e.status != 429:
+                raise
+            wait = delay
+        except (OSError, asyncio.TimeoutError):
+            wait = delay
+        if attempt == PROPAGATION_RETRIES:
+            raise
+        propagation_stats["retries"] += 1
+        await asyncio.sleep(wait + random.uniform(0, delay))
+        delay *= 2
+
+
+async def _ban_one(guild, user_id, sem, failures):
+    async with sem:
+        try:
+            await with_retries(guild.ban, discord.Object(id=user_id), reason="Sync ban", delete_message_seconds=0)
+            propagation_stats["banned"] += 1
+        except Exception as e:
+            propagation_stats["failed"] += 1
+            failures[user_id] = repr(e)
+            print(f"[SYNC] ban {user_id} impossible sur {guild.id}: {e}")
+
+
+async def _unban_one(guild, user_id, sem, failures):
+    async with sem:
+        try:
+            await with_retries(guild.unban, discord.Object(id=user_id), reason="Sync unban")
+            propagation_stats["unbanned"] += 1
+        except discord.NotFound:
+            pass  # pas banni sur ce serveur
+        except Exception as e:
+            propagation_stats["failed"] += 1
+            failures[user_id] = repr(e)
+            print(f"[SYNC] unban {user_id} impossible sur {guild.id}: {e}")
+
+
+async def _apply_bans(guild, user_ids, sem, failures):
+    """Bans par lots de BULK_BAN_SIZE ; repli un par un si bulk_ban est refusé."""
+    for i in range(0, len(user_ids), BULK_BAN_SIZE):
+        batch = user_ids[i:i + BULK_BAN_SIZE]
+        try:
+            result = await with_retries(guild.bulk_ban, [discord.Object(id=u) for u in batch],
+                                        reason="Sync ban", delete_message_seconds=0)
+            propagation_stats["banned"] += len(result.banned)
+            propagation_stats["failed"] += len(result.failed)
+            for obj in result.failed:
+                failures[obj.id] = "bulk_ban: échec"
+        except discord.HTTPException:
+            # bulk_ban demande aussi MANAGE_GUILD : on retente ban par ban
+            await asyncio.gather(*(_ban_one(guild, u, sem, failures) for u in batch))
+
+
+async def _apply_entries(guild, entries, sem, advance):
+    """Applique [(seq, user_id, action)] et enregistre le résultat (curseur avancé si advance)."""
+    errors = {"ban": {}, "unban": {}}  # action -> {user_id: erreur}
+    by_action = {"ban": [], "unban": []}
+    for _, user_id, action in entries:
+        by_action[action].append(user_id)
+    if by_action["ban"]:
+        await _apply_bans(guild, by_action["ban"], sem, errors["ban"])
+    if by_action["unban"]:
+        await asyncio.gather(*(_unban_one(guild, u, sem, errors["unban"]) for u in by_action["unban"]))
+    failures = {seq: errors[action][user_id] for seq, user_id, action in entries if user_id in errors[action]}
+    done = [seq for seq, _, _ in entries if seq not in failures]
+    await asyncio.to_thread(record_sync_results, guild.id, entries[-1][0] if advance else None, done, failures)
+
+
+async def propagate_guild(guild):
+    """Retente les échecs du serveur, puis applique les entrées du ledger postérieures à son curseur."""
+    sem = asyncio.Semaphore(PROPAGATION_PER_GUILD)
+    retry = await asyncio.to_thread(failed_sync, guild.id)
+    if retry:
+        await _apply_entries(guild, retry, sem, advance=False)
+    while True:
+        entries = await asyncio.to_thread(pending_sync, guild.id)
+        if not entries:
+            return
+        await _apply_entries(guild, entries, sem, advance=True)
+
+
+async def propagation_worker():
+    while True:
+        guild_id = await _propagation_queue.get()
+        _queued_guilds.discard(guild_id)
+        _active_guilds.add(guild_id)
+        try:
+            guild = bot.get_guild(guild_id)
+            if guild is not None:
+                await propagate_guild(guild)
+        except Exception as e:
+            print(f"[SYNC] erreur sur le serveur {guild_id}: {e}")
+        finally:
+            _active_guilds.discard(guild_id)
+            propagation_stats["guilds_done"] += 1
+            if guild_id in _rerun_guilds:
+                _rerun_guilds.discard(guild_id)
+                schedule_propagation(guild_id)
+            _propagation_queue.task_done()
+            if not _queued_guilds and not _active_guilds:
+                p = propagation_progress()
+                print(f"[SYNC] {p['guilds_done']} serveurs traités — {p['banned']} bans, "
+                      f"{p['unbanned']} unbans, {p['failed']} échecs, {p['actions_per_sec']} actions/s")
+
+
+def start_propagation_workers():
+    global _propagation_queue
+    if _propagation_queue is not None:
+        return
+    _propagation_queue = asyncio.Queue()
+    for _ in range(PROPAGATION_GUILDS):
+        asyncio.create_task(propagation_worker())
+
+
+# ----------------------------------------------------------
+# Bot Discord (même boucle que l'API)
+# ----------------------------------------------------------
+
+@bot.event
+async def setup_hook():
+    start_propagation_workers()
+
+
+@bot.event
+async def on_ready():
+    print(f"[BOT] Connecté en tant que {bot.user}")
+
+
+@bot.event
+async def on_guild_available(guild):
+    # uniquement les entrées que ce serveur n'a pas encore appliquées
+    schedule_propagation(guild.id)
 
-def start_bot():
-    @bot.event
-    async def on_ready():
-        print(f"[BOT] Connecté en tant que {bot.user}")
-
-    @bot.event
-    async def on_guild_available(guild):
-        for item in sync_queue:
-            if item["action"] == "ban":
-                try:
-                    user = await bot.fetch_user(item["user_id"])
-                    await guild.ban(user, reason="Sync ban")
-                except:
-                    pass
-            elif item["action"] == "unban":
-                try:
-                    user = await bot.fetch_user(item["user_id"])
-                    await guild.unban(user)
-                except:
-                    pass
-
-    bot.run(BOT_TOKEN)
-
-
-threading.Thread(target=start_bot).start()
 
 # ----------------------------------------------------------
 # Lancement du dashboard
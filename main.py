@@ -5,14 +5,24 @@
 # ============================================
 
 import os
+import sys
+import subprocess
 import discord
 import asyncio
 import json
 import sqlite3
+import threading
+import time
+import functools
 import traceback 
+import logging
+import typing
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from discord.ui import View, Button
 from discord.ext import commands
-from datetime import datetime
+from datetime import datetime, timezone
 
 # ============================================
 # CONFIGURATION
@@ -22,33 +32,466 @@ TOKEN = os.getenv("DISCORD_TOKEN")
 OWNER_ID = int(os.getenv("OWNER_ID", "489113166429683713"))
 PREFIX = "!"
 
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix=PREFIX, intents=intents, help_command=None)
+# ---------- INTENTS ----------
+# LEAN_MODE=1 : uniquement les intents utiles à la modération, pas de cache de
+# messages et pas de chunking au démarrage (chargement à la demande via
+# ensure_chunked). Les membres ne sont mis en cache que quand le gateway les
+# livre (joins, events) : le cache démarre vide mais n'est PAS borné, chaque
+# membre livré y reste jusqu'à son départ (joined=True est nécessaire pour
+# on_member_remove / on_member_update). Par défaut : Intents.all() et cache
+# complet.
+LEAN_MODE = os.getenv("LEAN_MODE", "0") == "1"
+
+def lean_intents():
+    intents = discord.Intents.none()
+    intents.guilds = True           # salons / rôles (snapshot, anti-nuke)
+    intents.members = True          # joins, départs, rôles des membres
+    intents.moderation = True       # bans + on_audit_log_entry_create
+    intents.guild_messages = True   # commandes préfixées
+    intents.dm_messages = True
+    intents.message_content = True
+    return intents
+
+if LEAN_MODE:
+    intents = lean_intents()
+    bot_options = {
+        "member_cache_flags": discord.MemberCacheFlags(voice=False, joined=True),
+        "chunk_guilds_at_startup": False,
+        "max_messages": None,
+    }
+else:
+    intents = discord.Intents.all()
+    bot_options = {}
+
+# ---------- SHARDING / CLUSTERS ----------
+# SHARD_COUNT > 0 : AutoShardedBot. Chaque processus (cluster) ne se connecte
+# qu'aux shards SHARD_IDS ; `python main.py --clusters N` est le coordinateur
+# qui lance N processus et les relance s'ils s'arrêtent. Les états par serveur
+# (trackers, cache de config, whitelist) ne couvrent donc que les serveurs des
+# shards du processus ; la vue globale (!serverlist) passe par la table
+# cluster_guilds de la base partagée.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))  # 0 = pas de sharding
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip()] or None
+CLUSTER_ID = int(os.getenv("CLUSTER_ID", "0"))
+CLUSTERED = SHARD_COUNT > 0 and SHARD_IDS is not None
+
+if "CLUSTER_ID" in os.environ and SHARD_COUNT > 0 and SHARD_IDS is None:
+    # worker lancé par le coordinateur sans shard : ne surtout pas retomber sur
+    # "tous les shards", chaque serveur serait géré par deux processus
+    raise SystemExit(f"[cluster] cluster {CLUSTER_ID} sans shard (SHARD_IDS vide), arrêt")
+
+if SHARD_COUNT > 0:
+    bot = commands.AutoShardedBot(command_prefix=PREFIX, intents=intents, help_command=None,
+                                  shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **bot_options)
+else:
+    bot = commands.Bot(command_prefix=PREFIX, intents=intents, help_command=None, **bot_options)
+
+def shard_of(guild_id):
+    return (guild_id >> 22) % max(1, SHARD_COUNT)
+
+def owns_guild(guild_id):
+    """True si le serveur appartient aux shards de ce processus."""
+    return not CLUSTERED or shard_of(guild_id) in SHARD_IDS
+
+
+DB_NAME = os.getenv("DB_NAME", "bot_data.sqlite")
 
+# ============================================
+# MÉTRIQUES (format texte Prometheus)
+# ============================================
+
+# Activées seulement si METRICS_PORT est défini : un petit serveur HTTP
+# asyncio (sans dépendance) sert GET /metrics. Désactivées, @instrumented
+# rend la fonction telle quelle et les timers s'arrêtent au premier test.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+if METRICS_PORT and CLUSTERED:
+    METRICS_PORT += CLUSTER_ID  # un port par cluster
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_ENABLED = METRICS_PORT > 0
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# {nom: (label, aide)}
+METRICS_HELP = {
+    "bot_event_duration_seconds": ("handler", "Durée des handlers d'événements Discord"),
+    "bot_db_duration_seconds": ("fn", "Durée des helpers SQLite (attente du thread DB incluse)"),
+    "bot_rest_duration_seconds": ("route", "Durée des appels REST Discord"),
+    "bot_audit_latency_seconds": ("source", "Délai entre une action et son attribution par l'audit log"),
+    "bot_containment_latency_seconds": ("method", "Délai entre la détection d'un nuke et le confinement"),
+    "bot_rate_limit_hits_total": ("scope", "Réponses 429 reçues de Discord"),
+    "bot_errors_total": ("where", "Exceptions levées dans les chemins instrumentés"),
+}
 
-DB_NAME = "bot_data.sqlite"
+_histograms = {}  # {(nom, label): [compte par bucket..., +Inf, somme]}
+_counters = {}    # {(nom, label): valeur}
+
+def observe(name, label, seconds):
+    h = _histograms.get((name, label))
+    if h is None:
+        h = _histograms[(name, label)] = [0] * (len(METRICS_BUCKETS) + 2)
+    for i, bound in enumerate(METRICS_BUCKETS):
+        if seconds <= bound:
+            h[i] += 1
+            break
+    else:
+        h[len(METRICS_BUCKETS)] += 1
+    h[-1] += seconds
+
+def inc(name, label="", value=1):
+    key = (name, label)
+    _counters[key] = _counters.get(key, 0) + value
+
+class MetricTimer:
+    """`with MetricTimer(nom, label):` - observe la durée du bloc (rien si désactivé)."""
+    __slots__ = ("name", "label", "start")
+
+    def __init__(self, name, label):
+        self.name = name
+        self.label = label
+
+    def __enter__(self):
+        if METRICS_ENABLED:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if METRICS_ENABLED:
+            observe(self.name, self.label, time.perf_counter() - self.start)
+            if exc_type is not None:
+                inc("bot_errors_total", self.label)
+        return False
+
+def rest_timer(route):
+    return MetricTimer("bot_rest_duration_seconds", route)
+
+def instrumented(fn):
+    """Décorateur des handlers d'événements : histogramme de durée par handler."""
+    if not METRICS_ENABLED:
+        return fn
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        with MetricTimer("bot_event_duration_seconds", name):
+            return await fn(*args, **kwargs)
+    return wrapper
+
+class TimedContext(commands.Context):
+    """Contexte des commandes : chaque réponse (ctx.send) est un appel REST chronométré."""
+
+    async def send(self, *args, **kwargs):
+        with rest_timer("ctx.send"):
+            return await super().send(*args, **kwargs)
+
+if METRICS_ENABLED:
+    _base_get_context = bot.get_context
+
+    async def _timed_get_context(origin, *, cls=TimedContext):
+        return await _base_get_context(origin, cls=cls)
+
+    bot.get_context = _timed_get_context
+
+class _RateLimitCounter(logging.Handler):
+    """discord.py ne signale les 429 que par ses logs : on les compte ici."""
+
+    def emit(self, record):
+        msg = str(record.msg)
+        if "responded with 429" in msg:
+            inc("bot_rate_limit_hits_total", "route")
+        elif "Global rate limit has been hit" in msg:
+            # discord.py logue d'abord le 429 générique puis celui-ci, sans
+            # await entre les deux : on reclasse le 429 déjà compté
+            inc("bot_rate_limit_hits_total", "route", -1)
+            inc("bot_rate_limit_hits_total", "global")
+
+# Profondeurs de files et tailles de caches, lues au moment du scrape
+METRICS_GAUGES = (
+    ("bot_log_queue_depth", "Lignes et embeds de logs en attente d'envoi",
+     lambda: sum(len(q["lines"]) + len(q["embeds"]) for q in _log_queues.values())),
+    ("bot_pending_writes", "Insertions en attente dans le tampon de group commit", lambda: _pending_write_count),
+    ("bot_db_executor_queue", "Tâches en attente sur le thread DB", lambda: _db_executor._work_queue.qsize()),
+    ("bot_config_cache_size", "Configs en cache", lambda: len(_config_cache)),
+    ("bot_user_cache_size", "Utilisateurs résolus en cache", lambda: len(_user_cache)),
+    ("bot_owner_alerts_pending", "Alertes owner en attente du prochain digest", lambda: len(_owner_alerts)),
+    ("bot_command_audit_depth", "Entrées d'audit de commandes en attente", lambda: len(_command_audit)),
+    ("bot_action_trackers", "Executors suivis par l'anti-nuke", lambda: sum(len(g) for g in action_trackers.values())),
+    ("bot_guilds", "Serveurs connectés", lambda: len(bot.guilds)),
+)
+
+# Compteurs tenus dans des dicts de stats (aussi affichés par !auditstats),
+# lus au moment du scrape : (nom, label, aide, dict)
+METRICS_STAT_COUNTERS = (
+    ("bot_config_cache_total", "result", "Accès au cache de config (hits / misses / evictions)", lambda: config_cache_stats),
+    ("bot_user_cache_total", "result", "Accès au cache d'utilisateurs (hits / misses)", lambda: user_cache_stats),
+    ("bot_audit_attributions_total", "source", "Actions attribuées par l'audit log (gateway / rest / unattributed)",
+     lambda: audit_stats),
+    ("bot_containments_total", "result", "Confinements anti-nuke (contained / failed)", lambda: containment_stats),
+)
+
+def _fmt_bound(bound):
+    return repr(float(bound))
+
+def render_metrics():
+    """Toutes les métriques au format texte Prometheus 0.0.4."""
+    out = []
+    for name, (label_name, help_text) in METRICS_HELP.items():
+        is_hist = name.endswith("_seconds")
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {'histogram' if is_hist else 'counter'}")
+        if is_hist:
+            for (n, label), h in sorted(_histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(METRICS_BUCKETS, h):
+                    cumulative += count
+                    out.append(f'{name}_bucket{{{label_name}="{label}",le="{_fmt_bound(bound)}"}} {cumulative}')
+                cumulative += h[len(METRICS_BUCKETS)]
+                out.append(f'{name}_bucket{{{label_name}="{label}",le="+Inf"}} {cumulative}')
+                out.append(f'{name}_sum{{{label_name}="{label}"}} {h[-1]}')
+                out.append(f'{name}_count{{{label_name}="{label}"}} {cumulative}')
+        else:
+            for (n, label), value in sorted(_counters.items()):
+                if n == name:
+                    out.append(f'{name}{{{label_name}="{label}"}} {value}')
+    for name, label_name, help_text, fn in METRICS_STAT_COUNTERS:
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} counter")
+        for label, value in sorted(fn().items()):
+            out.append(f'{name}{{{label_name}="{label}"}} {value}')
+    for name, help_text, fn in METRICS_GAUGES:
+        try:
+            value = fn()
+        except Exception:
+            continue
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} gauge")
+        out.append(f"{name} {value}")
+    return "\n".join(out) + "\n"
+
+async def _handle_metrics_request(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", render_metrics().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
+
+_metrics_server = None
+
+async def start_metrics_server():
+    """Démarre le serveur /metrics (une seule fois, no-op si désactivé)."""
+    global _metrics_server
+    if not METRICS_ENABLED or _metrics_server is not None:
+        return
+    logging.getLogger("discord.http").addHandler(_RateLimitCounter(logging.WARNING))
+    _metrics_server = await asyncio.start_server(_handle_metrics_request, METRICS_HOST, METRICS_PORT)
+    print(f"[metrics] http://{METRICS_HOST}:{METRICS_PORT}/metrics")
 
 # ============================================
 # BASE DE DONNÉES
 # ============================================
 
+# Connexion SQLite unique, partagée par tous les helpers (WAL + cache de
+# requêtes préparées). Les écritures passent par db_write / db_batch.
+_db_conn = None
+_db_lock = threading.RLock()
+_db_batch_depth = 0
+
 def db_connect():
-    return sqlite3.connect(DB_NAME)
+    """Retourne la connexion partagée (ouverte et configurée au premier appel)."""
+    global _db_conn
+    if _db_conn is None:
+        with _db_lock:
+            if _db_conn is None:
+                conn = sqlite3.connect(DB_NAME, check_same_thread=False, cached_statements=256)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA temp_store=MEMORY")
+                conn.execute("PRAGMA busy_timeout=5000")
+                _db_conn = conn
+    return _db_conn
+
+def db_close():
+    """Commit et ferme la connexion partagée (arrêt du bot)."""
+    global _db_conn
+    with _db_lock:
+        if _db_conn is not None:
+            _db_conn.commit()
+            _db_conn.close()
+            _db_conn = None
+
+def db_fetchone(sql, params=()):
+    with _db_lock:
+        return db_connect().execute(sql, params).fetchone()
+
+def db_fetchall(sql, params=()):
+    with _db_lock:
+        return db_connect().execute(sql, params).fetchall()
+
+def db_write(sql, params=()):
+    """Exécute une écriture. Commit immédiat, sauf à l'intérieur d'un db_batch()."""
+    with _db_lock:
+        conn = db_connect()
+        cur = conn.execute(sql, params)
+        if _db_batch_depth == 0:
+            conn.commit()
+        return cur.rowcount
 
-def init_db():
-    conn = db_connect()
-    cur = conn.cursor()
+def db_write_many(sql, rows):
+    """executemany dans une seule transaction."""
+    with _db_lock:
+        conn = db_connect()
+        cur = conn.executemany(sql, rows)
+        if _db_batch_depth == 0:
+            conn.commit()
+        return cur.rowcount
 
-    # Config serveur
-    cur.execute("""
+@contextmanager
+def db_batch():
+    """Regroupe plusieurs db_write dans une seule transaction (un seul commit)."""
+    global _db_batch_depth
+    with _db_lock:
+        conn = db_connect()
+        _db_batch_depth += 1
+        try:
+            yield conn
+        except Exception:
+            _db_batch_depth -= 1
+            if _db_batch_depth == 0:
+                conn.rollback()
+            raise
+        else:
+            _db_batch_depth -= 1
+            if _db_batch_depth == 0:
+                try:
+                    conn.commit()
+                except Exception:
+                    conn.rollback()  # ex. SQLITE_BUSY : la transaction ne reste pas ouverte
+                    raise
+
+# Thread dédié au disque : les coroutines ne touchent jamais SQLite directement,
+# elles passent par `await db_run(helper, *args)`.
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+async def db_run(fn, *args, **kwargs):
+    """Exécute un helper SQLite synchrone dans le thread DB, sans bloquer la boucle asyncio."""
+    loop = asyncio.get_running_loop()
+    with MetricTimer("bot_db_duration_seconds", fn.__name__):
+        return await loop.run_in_executor(_db_executor, functools.partial(fn, *args, **kwargs))
+
+# ---------- WRITE-BEHIND (group commit) ----------
+# Les insertions à fort volume (logs, warns) sont mises en tampon côté
+# asyncio puis écrites par executemany dans une seule transaction, toutes
+# les WRITE_BEHIND_INTERVAL secondes ou dès WRITE_BEHIND_BATCH lignes.
+# Au-delà de WRITE_BEHIND_MAX lignes en attente, queue_write attend la
+# fin du flush en cours (back-pressure). Si la transaction échoue (ex.
+# SQLITE_BUSY), le lot est remis dans le tampon et réessayé. Lire des données
+# mises en tampon : `await flush_pending_writes()` d'abord.
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.05"))
+WRITE_BEHIND_BATCH = 500
+WRITE_BEHIND_MAX = 10000
+WRITE_BEHIND_RETRY_DELAY = 1.0
+
+_pending_writes = {}  # {sql: [params, ...]}
+_pending_write_count = 0
+_write_behind_task = None
+_write_behind_wake = None
+_write_behind_drained = None
+
+def _flush_writes(batches):
+    with db_batch():
+        for sql, rows in batches.items():
+            db_write_many(sql, rows)
+
+def _take_pending_writes():
+    global _pending_writes, _pending_write_count
+    batches, _pending_writes, _pending_write_count = _pending_writes, {}, 0
+    return batches
+
+def _restore_pending_writes(batches):
+    """Remet en tête du tampon un lot dont la transaction a échoué (réessayé au flush suivant)."""
+    global _pending_writes, _pending_write_count
+    for sql, rows in _pending_writes.items():
+        batches.setdefault(sql, []).extend(rows)
+    _pending_writes = batches
+    _pending_write_count = sum(len(rows) for rows in batches.values())
+
+async def flush_pending_writes():
+    """Écrit immédiatement tout le tampon (une transaction). En cas d'échec, le lot est conservé."""
+    batches = _take_pending_writes()
+    try:
+        if batches:
+            await db_run(_flush_writes, batches)
+    except Exception:
+        _restore_pending_writes(batches)
+        raise
+    finally:
+        if _write_behind_drained is not None:
+            _write_behind_drained.set()
+
+def flush_pending_writes_sync():
+    """Flush synchrone, pour l'arrêt du bot (boucle asyncio déjà fermée)."""
+    batches = _take_pending_writes()
+    if batches:
+        _flush_writes(batches)
+
+async def _write_behind_loop():
+    while True:
+        try:
+            await asyncio.wait_for(_write_behind_wake.wait(), WRITE_BEHIND_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _write_behind_wake.clear()
+        try:
+            await flush_pending_writes()
+        except Exception:
+            traceback.print_exc()
+            await asyncio.sleep(WRITE_BEHIND_RETRY_DELAY)  # lot conservé, nouvel essai après une pause
+
+async def queue_write(sql, params):
+    """Ajoute une insertion au tampon de group commit."""
+    global _pending_write_count, _write_behind_task, _write_behind_wake, _write_behind_drained
+    if _write_behind_task is None or _write_behind_task.done():
+        _write_behind_wake = asyncio.Event()
+        _write_behind_drained = asyncio.Event()
+        _write_behind_task = asyncio.create_task(_write_behind_loop())
+    while _pending_write_count >= WRITE_BEHIND_MAX:
+        _write_behind_drained.clear()
+        _write_behind_wake.set()
+        await _write_behind_drained.wait()
+    _pending_writes.setdefault(sql, []).append(params)
+    _pending_write_count += 1
+    if _pending_write_count >= WRITE_BEHIND_BATCH:
+        _write_behind_wake.set()
+
+# ---------- MIGRATIONS ----------
+# Schéma versionné : chaque étape (version, description, requêtes) n'est
+# appliquée qu'une fois, dans sa propre transaction, et la version courante
+# est stockée dans schema_version. Les étapes utilisent IF NOT EXISTS pour
+# s'appliquer aussi aux bases créées avant l'existence de ce système.
+MIGRATIONS = [
+    (1, "tables de base", [
+        # Config serveur
+        """
         CREATE TABLE IF NOT EXISTS guild_config (
             guild_id INTEGER PRIMARY KEY,
             config_json TEXT
         )
-    """)
-
-    # Warns
-    cur.execute("""
+        """,
+        # Warns
+        """
         CREATE TABLE IF NOT EXISTS warns (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             guild_id INTEGER,
@@ -57,27 +500,132 @@ def init_db():
             reason TEXT,
             timestamp INTEGER
         )
-    """)
-
-    # Snapshots
-    cur.execute("""
+        """,
+        # Snapshots
+        """
         CREATE TABLE IF NOT EXISTS snapshots (
             guild_id INTEGER PRIMARY KEY,
             snapshot_json TEXT
         )
-    """)
-
-    # Whitelist
-    cur.execute("""
+        """,
+        # Whitelist
+        """
         CREATE TABLE IF NOT EXISTS whitelist (
             guild_id INTEGER,
             user_id INTEGER,
             PRIMARY KEY (guild_id, user_id)
         )
-    """)
+        """,
+        # Logs
+        """
+        CREATE TABLE IF NOT EXISTS logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER,
+            event_type TEXT,
+            event_json TEXT,
+            timestamp INTEGER
+        )
+        """,
+    ]),
+    (2, "snapshot incrémental (deltas versionnés, version = id)", [
+        """
+        CREATE TABLE IF NOT EXISTS snapshot_deltas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER,
+            kind TEXT,
+            object_id INTEGER,
+            op TEXT,
+            data_json TEXT,
+            timestamp INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_snapshot_deltas_guild ON snapshot_deltas (guild_id, id)",
+    ]),
+    (3, "index des logs, agrégats, état de maintenance", [
+        "CREATE INDEX IF NOT EXISTS idx_logs_guild_time ON logs (guild_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_guild_type_time ON logs (guild_id, event_type, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_time ON logs (timestamp)",
+        # Agrégats de logs par serveur / type (heure et jour), conservés après la purge
+        """
+        CREATE TABLE IF NOT EXISTS logs_rollup_hourly (
+            guild_id INTEGER,
+            event_type TEXT,
+            bucket INTEGER,
+            count INTEGER,
+            PRIMARY KEY (guild_id, event_type, bucket)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS logs_rollup_daily (
+            guild_id INTEGER,
+            event_type TEXT,
+            bucket INTEGER,
+            count INTEGER,
+            PRIMARY KEY (guild_id, event_type, bucket)
+        )
+        """,
+        # Etat de la maintenance (curseur de rollup, ...)
+        """
+        CREATE TABLE IF NOT EXISTS maintenance_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        )
+        """,
+    ]),
+    (4, "index des warns par membre", [
+        "CREATE INDEX IF NOT EXISTS idx_warns_guild_user ON warns (guild_id, user_id)",
+    ]),
+    (5, "serveurs par cluster (vue globale en mode multi-processus)", [
+        """
+        CREATE TABLE IF NOT EXISTS cluster_guilds (
+            guild_id INTEGER PRIMARY KEY,
+            cluster_id INTEGER,
+            shard_id INTEGER,
+            name TEXT,
+            member_count INTEGER,
+            updated_at INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_cluster_guilds_cluster ON cluster_guilds (cluster_id)",
+    ]),
+    (6, "auteur des deltas de snapshot (purge ciblée après un nuke)", [
+        "ALTER TABLE snapshot_deltas ADD COLUMN executor_id INTEGER",
+        "CREATE INDEX IF NOT EXISTS idx_snapshot_deltas_executor ON snapshot_deltas (guild_id, executor_id)",
+    ]),
+]
+
+def get_schema_version():
+    row = db_fetchone("SELECT MAX(version) FROM schema_version")
+    return row[0] or 0
 
-    conn.commit()
-    conn.close()
+def init_db():
+    """Applique les migrations manquantes (une seule fois, au démarrage)."""
+    with _db_lock:
+        conn = db_connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at INTEGER
+            )
+        """)
+        current = get_schema_version()
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            conn.execute("BEGIN")
+            try:
+                for sql in statements:
+                    conn.execute(sql)
+                conn.execute(
+                    "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                    (version, description, int(time.time()))
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            print(f"[DB] migration {version} appliquée: {description}")
 
 # ============================================
 # CHARGEMENT + SAUVEGARDE CONFIG
@@ -87,6 +635,7 @@ DEFAULT_CONFIG = {
     "antiraid": False,
     "join_limit": 5,
     "join_window": 10,
+    "lockdown_duration": 300,
     "anti_nuke": True,
     "nuke_actions_limit": 3,
     "log_channel": None,
@@ -94,43 +643,175 @@ DEFAULT_CONFIG = {
     "warn_action": "mute"
 }
 
+# Cache mémoire des configs (LRU borné). Les lectures viennent de la mémoire,
+# save_config écrit en base puis met à jour le cache (write-through).
+CONFIG_CACHE_SIZE = int(os.getenv("CONFIG_CACHE_SIZE", "5000"))
+_config_cache = OrderedDict()
+_config_cache_lock = threading.Lock()
+config_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def _config_cache_get(guild_id):
+    with _config_cache_lock:
+        cfg = _config_cache.get(guild_id)
+        if cfg is None:
+            config_cache_stats["misses"] += 1
+            return None
+        _config_cache.move_to_end(guild_id)
+        config_cache_stats["hits"] += 1
+        return dict(cfg)
+
+def _config_cache_put(guild_id, config):
+    with _config_cache_lock:
+        _config_cache[guild_id] = dict(config)
+        _config_cache.move_to_end(guild_id)
+        while len(_config_cache) > CONFIG_CACHE_SIZE:
+            _config_cache.popitem(last=False)
+            config_cache_stats["evictions"] += 1
+
+def invalidate_config(guild_id=None):
+    """Retire une config du cache (toutes si guild_id est None)."""
+    with _config_cache_lock:
+        if guild_id is None:
+            _config_cache.clear()
+        else:
+            _config_cache.pop(guild_id, None)
+
 def load_config(guild_id):
-    conn = db_connect()
-    cur = conn.cursor()
-    cur.execute("SELECT config_json FROM guild_config WHERE guild_id=?", (guild_id,))
-    row = cur.fetchone()
+    cfg = _config_cache_get(guild_id)
+    if cfg is not None:
+        return cfg
+    return _load_config_db(guild_id)
+
+def _load_config_db(guild_id):
+    row = db_fetchone("SELECT config_json FROM guild_config WHERE guild_id=?", (guild_id,))
 
     if row:
-        conn.close()
-        return json.loads(row[0])
+        cfg = json.loads(row[0])
+        # ancien compteur de joins stocké dans la config (remplacé par join_windows)
+        cfg.pop("_joins_tmp", None)
+        _config_cache_put(guild_id, cfg)
+        return dict(cfg)
 
     # Si pas de config, créer la config par défaut
     save_config(guild_id, DEFAULT_CONFIG)
-    conn.close()
     return DEFAULT_CONFIG.copy()
 
 def save_config(guild_id, config):
-    conn = db_connect()
-    cur = conn.cursor()
-    cur.execute(
+    db_write(
         "INSERT OR REPLACE INTO guild_config (guild_id, config_json) VALUES (?, ?)",
         (guild_id, json.dumps(config))
     )
-    conn.commit()
-    conn.close()
+    _config_cache_put(guild_id, config)
+
+async def get_config(guild_id):
+    """Version async de load_config : servie depuis le cache, thread DB seulement sur miss."""
+    cfg = _config_cache_get(guild_id)
+    if cfg is not None:
+        return cfg
+    return await db_run(_load_config_db, guild_id)
 
 # ============================================
 # LOGS
 # ============================================
 
-async def send_log(guild, msg):
+# File de logs par serveur : send_log ne fait qu'empiler, un flush différé
+# regroupe les lignes en messages de 2000 caractères max (et les embeds par
+# 10 / 6000 caractères). Les actions de modération n'attendent jamais Discord.
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.5"))
+LOG_QUEUE_MAX = 500
+LOG_MAX_CHARS = 2000
+EMBED_MAX_PER_MESSAGE = 10
+EMBED_MAX_CHARS = 6000
+
+_log_queues = {}       # {guild_id: {"lines": deque, "embeds": deque, "dropped": int}}
+_log_flush_tasks = {}  # {guild_id: asyncio.Task}
+
+async def send_log(guild, msg=None, embed=None):
+    try:
+        cfg = await get_config(guild.id)
+        if not cfg.get("log_channel"):
+            return
+        q = _log_queues.get(guild.id)
+        if q is None:
+            q = _log_queues[guild.id] = {"lines": deque(), "embeds": deque(), "dropped": 0}
+        if msg is not None:
+            if len(q["lines"]) >= LOG_QUEUE_MAX:
+                q["lines"].popleft()
+                q["dropped"] += 1
+            q["lines"].append(str(msg))
+        if embed is not None:
+            if len(q["embeds"]) >= LOG_QUEUE_MAX:
+                q["embeds"].popleft()
+                q["dropped"] += 1
+            q["embeds"].append(embed)
+        if guild.id not in _log_flush_tasks:
+            _log_flush_tasks[guild.id] = asyncio.create_task(_flush_logs_later(guild))
+    except:
+        traceback.print_exc()
+
+def _chunk_log_lines(lines):
+    """Regroupe des lignes en blocs de LOG_MAX_CHARS caractères maximum."""
+    chunks = []
+    current = ""
+    for line in lines:
+        while len(line) > LOG_MAX_CHARS:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:LOG_MAX_CHARS])
+            line = line[LOG_MAX_CHARS:]
+        if not current:
+            current = line
+        elif len(current) + 1 + len(line) <= LOG_MAX_CHARS:
+            current += "\n" + line
+        else:
+            chunks.append(current)
+            current = line
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _chunk_log_embeds(embeds):
+    """Regroupe des embeds par EMBED_MAX_PER_MESSAGE en respectant EMBED_MAX_CHARS."""
+    groups = []
+    current, size = [], 0
+    for emb in embeds:
+        n = len(emb)
+        if current and (len(current) >= EMBED_MAX_PER_MESSAGE or size + n > EMBED_MAX_CHARS):
+            groups.append(current)
+            current, size = [], 0
+        current.append(emb)
+        size += n
+    if current:
+        groups.append(current)
+    return groups
+
+async def _flush_logs_later(guild):
     try:
-        cfg = load_config(guild.id)
-        channel_id = cfg.get("log_channel")
-        if channel_id:
-            channel = guild.get_channel(channel_id)
-            if channel:
-                await channel.send(msg)
+        await asyncio.sleep(LOG_FLUSH_INTERVAL)
+    finally:
+        _log_flush_tasks.pop(guild.id, None)
+    await flush_logs(guild)
+
+async def flush_logs(guild):
+    """Envoie immédiatement tout ce qui est en attente pour ce serveur."""
+    q = _log_queues.pop(guild.id, None)
+    if not q:
+        return
+    lines = list(q["lines"])
+    if q["dropped"]:
+        lines.append(f"… {q['dropped']} entrées de log ignorées (file pleine)")
+    try:
+        cfg = await get_config(guild.id)
+        channel = guild.get_channel(cfg.get("log_channel") or 0)
+        if not channel:
+            return
+        for chunk in _chunk_log_lines(lines):
+            with rest_timer("channel.send"):
+                await channel.send(chunk)
+        for group in _chunk_log_embeds(q["embeds"]):
+            with rest_timer("channel.send"):
+                await channel.send(embeds=group)
     except:
         traceback.print_exc()
 
@@ -138,27 +819,44 @@ async def send_log(guild, msg):
 # WHITELIST
 # ============================================
 
+# Whitelist chargée une fois en mémoire ({guild_id: set(user_id)}) puis tenue
+# à jour par add_whitelist / remove_whitelist : les checks sont en O(1).
+_whitelists = {}
+
+def read_whitelists():
+    """Whitelist des serveurs de ce processus, lue en base : {guild_id: {user_id}}."""
+    wl = {}
+    for guild_id, user_id in db_fetchall("SELECT guild_id, user_id FROM whitelist"):
+        if owns_guild(guild_id):
+            wl.setdefault(guild_id, set()).add(user_id)
+    return wl
+
+def load_whitelists(wl=None):
+    """
+    Remplace la whitelist en mémoire d'un seul coup (nouveau dict) : les
+    lecteurs voient l'ancienne ou la nouvelle, jamais une whitelist vide.
+    """
+    global _whitelists
+    _whitelists = read_whitelists() if wl is None else wl
+
 def is_whitelisted(guild_id, user_id):
-    conn = db_connect()
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM whitelist WHERE guild_id=? AND user_id=?", (guild_id, user_id))
-    row = cur.fetchone()
-    conn.close()
-    return row is not None
+    members = _whitelists.get(guild_id)
+    return members is not None and user_id in members
+
+def list_whitelist(guild_id):
+    return sorted(_whitelists.get(guild_id, ()))
 
 def add_whitelist(guild_id, user_id):
-    conn = db_connect()
-    cur = conn.cursor()
-    cur.execute("INSERT OR REPLACE INTO whitelist (guild_id, user_id) VALUES (?, ?)", (guild_id, user_id))
-    conn.commit()
-    conn.close()
+    db_write("INSERT OR REPLACE INTO whitelist (guild_id, user_id) VALUES (?, ?)", (guild_id, user_id))
+    _whitelists.setdefault(guild_id, set()).add(user_id)
 
 def remove_whitelist(guild_id, user_id):
-    conn = db_connect()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM whitelist WHERE guild_id=? AND user_id=?", (guild_id, user_id))
-    conn.commit()
-    conn.close()
+    db_write("DELETE FROM whitelist WHERE guild_id=? AND user_id=?", (guild_id, user_id))
+    members = _whitelists.get(guild_id)
+    if members is not None:
+        members.discard(user_id)
+        if not members:
+            del _whitelists[guild_id]
 
 # ============================================
 # UTILITAIRES
@@ -177,7 +875,80 @@ def is_staff(ctx) -> bool:
     if ctx.author.id == OWNER_ID:
         return True
 
-    return ctx.author.id in list_whitelist(ctx.guild.id)
+    return is_whitelisted(ctx.guild.id, ctx.author.id)
+
+# ---------- RÉSOLUTION DES UTILISATEURS ----------
+# fetch_user = un appel REST. On passe d'abord par le cache gateway
+# (get_member / get_user), puis par un LRU à TTL partagé par tout le bot.
+# Les demandes simultanées pour un même id attendent le même fetch.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "2000"))
+USER_CACHE_TTL = 3600
+
+_user_cache = OrderedDict()  # {user_id: (user ou None, expiration time.monotonic)}
+_user_fetches = {}           # {user_id: asyncio.Task} fetchs en cours
+user_cache_stats = {"hits": 0, "misses": 0}
+
+async def _fetch_user(user_id):
+    try:
+        with rest_timer("fetch_user"):
+            user = await bot.fetch_user(user_id)
+    except discord.NotFound:
+        user = None  # mis en cache aussi : inutile de redemander un compte supprimé
+    except discord.HTTPException:
+        return None
+    finally:
+        _user_fetches.pop(user_id, None)
+    _user_cache[user_id] = (user, time.monotonic() + USER_CACHE_TTL)
+    _user_cache.move_to_end(user_id)
+    while len(_user_cache) > USER_CACHE_SIZE:
+        _user_cache.popitem(last=False)
+    return user
+
+async def resolve_user(user_id, guild=None):
+    """Membre / utilisateur pour un id, sans REST si possible. None si introuvable."""
+    if guild is not None:
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+    user = bot.get_user(user_id)
+    if user is not None:
+        return user
+    cached = _user_cache.get(user_id)
+    if cached is not None and cached[1] > time.monotonic():
+        _user_cache.move_to_end(user_id)
+        user_cache_stats["hits"] += 1
+        return cached[0]
+    user_cache_stats["misses"] += 1
+    task = _user_fetches.get(user_id)
+    if task is None:
+        task = _user_fetches[user_id] = asyncio.create_task(_fetch_user(user_id))
+    return await asyncio.shield(task)
+
+async def resolve_users(user_ids, guild=None):
+    """{user_id: user ou None} pour plusieurs ids, fetchs en parallèle."""
+    ids = list(dict.fromkeys(user_ids))
+    users = await asyncio.gather(*(resolve_user(uid, guild) for uid in ids))
+    return dict(zip(ids, users))
+
+def display_user(user, user_id):
+    return getattr(user, "display_name", None) or str(user_id)
+
+async def ensure_chunked(guild):
+    """Liste complète des membres en cache (en mode lean, chargée à la première demande)."""
+    if not guild.chunked:
+        with rest_timer("guild.chunk"):
+            await guild.chunk(cache=True)
+
+async def get_or_fetch_member(guild, user_id):
+    """Membre depuis le cache, sinon via l'API (None s'il n'est plus sur le serveur)."""
+    member = guild.get_member(user_id)
+    if member is None:
+        try:
+            with rest_timer("fetch_member"):
+                member = await guild.fetch_member(user_id)
+        except discord.HTTPException:
+            return None
+    return member
 
 # ============================================
 # PARTIE 2 / 7
@@ -185,188 +956,571 @@ def is_staff(ctx) -> bool:
 # ============================================
 
 # In-memory tracker pour anti-nuke (sera utilisé dans les parties suivantes)
-action_trackers = {}  # {guild_id: {executor_id: {"ban":[], "kick":[], "channel_del":[], "role_del":[]}}}
+action_trackers = {}  # {guild_id: {executor_id: ActionTracker}}
 
 # ---------- DB helpers pour warns / snapshot ----------
-def add_warn_db(guild_id, user_id, moderator_id, reason):
-    conn = db_connect()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO warns (guild_id, user_id, moderator_id, reason, timestamp) VALUES (?, ?, ?, ?, ?)",
-        (guild_id, user_id, moderator_id, reason, ts())
-    )
-    conn.commit()
-    conn.close()
+WARN_INSERT_SQL = "INSERT INTO warns (guild_id, user_id, moderator_id, reason, timestamp) VALUES (?, ?, ?, ?, ?)"
+
+async def queue_warn(guild_id, user_id, moderator_id, reason):
+    await queue_write(WARN_INSERT_SQL, (guild_id, user_id, moderator_id, reason, ts()))
 
 def get_warns_db(guild_id, user_id):
-    conn = db_connect()
-    cur = conn.cursor()
-    cur.execute(
+    return db_fetchall(
         "SELECT id, moderator_id, reason, timestamp FROM warns WHERE guild_id=? AND user_id=? ORDER BY id",
         (guild_id, user_id)
     )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
 
 def clear_warns_db(guild_id, user_id):
-    conn = db_connect()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM warns WHERE guild_id=? AND user_id=?", (guild_id, user_id))
-    conn.commit()
-    conn.close()
+    db_write("DELETE FROM warns WHERE guild_id=? AND user_id=?", (guild_id, user_id))
+
+# Snapshot = base (table snapshots, avec "version") + deltas postérieurs
+# (table snapshot_deltas). Les suppressions ne sont appliquées qu'après
+# SNAPSHOT_DELETE_GRACE secondes : un nuke ne fait pas disparaître du point
+# de restauration les salons / rôles qu'il vient de supprimer.
+SNAPSHOT_DELETE_GRACE = 3600
+SNAPSHOT_COMPACT_EVERY = 200
 
 def save_snapshot_db(guild_id, snapshot):
-    conn = db_connect()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT OR REPLACE INTO snapshots (guild_id, snapshot_json) VALUES (?, ?)",
-        (guild_id, json.dumps(snapshot))
-    )
-    conn.commit()
-    conn.close()
+    """Remplace la base par un snapshot complet et oublie les deltas qu'il couvre."""
+    with db_batch():
+        row = db_fetchone("SELECT MAX(id) FROM snapshot_deltas WHERE guild_id=?", (guild_id,))
+        version = row[0] or 0
+        snapshot = dict(snapshot, version=version)
+        db_write(
+            "INSERT OR REPLACE INTO snapshots (guild_id, snapshot_json) VALUES (?, ?)",
+            (guild_id, json.dumps(snapshot))
+        )
+        db_write("DELETE FROM snapshot_deltas WHERE guild_id=? AND id<=?", (guild_id, version))
 
-def load_snapshot_db(guild_id):
-    conn = db_connect()
-    cur = conn.cursor()
-    cur.execute("SELECT snapshot_json FROM snapshots WHERE guild_id=?", (guild_id,))
-    row = cur.fetchone()
-    conn.close()
+def _load_snapshot_base(guild_id):
+    row = db_fetchone("SELECT snapshot_json FROM snapshots WHERE guild_id=?", (guild_id,))
     return json.loads(row[0]) if row else None
 
+def _apply_snapshot_deltas(snap, deltas, now):
+    roles = OrderedDict((r.get("id") or r.get("name"), r) for r in snap.get("roles", []))
+    channels = OrderedDict((c.get("id") or c.get("name"), c) for c in snap.get("channels", []))
+    version = snap.get("version", 0)
+    for delta_id, kind, object_id, op, data_json, t in deltas:
+        store = roles if kind == "role" else channels
+        if op == "delete":
+            if now - t >= SNAPSHOT_DELETE_GRACE:
+                store.pop(object_id, None)
+        else:
+            store[object_id] = json.loads(data_json)
+        version = delta_id
+    return {"version": version, "roles": list(roles.values()), "channels": list(channels.values())}
+
+def load_snapshot_db(guild_id):
+    """Point de restauration courant : base + deltas."""
+    snap = _load_snapshot_base(guild_id)
+    if snap is None:
+        return None
+    deltas = db_fetchall(
+        "SELECT id, kind, object_id, op, data_json, timestamp FROM snapshot_deltas WHERE guild_id=? AND id>? ORDER BY id",
+        (guild_id, snap.get("version", 0))
+    )
+    return _apply_snapshot_deltas(snap, deltas, ts())
+
+_snapshot_delta_counts = {}  # {guild_id: deltas depuis la dernière compaction}
+
+def record_snapshot_delta(guild_id, kind, object_id, op, data=None, executor_id=None):
+    """Ajoute un delta (upsert/delete) ; compacte tous les SNAPSHOT_COMPACT_EVERY deltas."""
+    db_write(
+        "INSERT INTO snapshot_deltas (guild_id, kind, object_id, op, data_json, timestamp, executor_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (guild_id, kind, object_id, op, json.dumps(data) if data is not None else None, ts(), executor_id)
+    )
+    count = _snapshot_delta_counts.get(guild_id, 0) + 1
+    _snapshot_delta_counts[guild_id] = count
+    if count >= SNAPSHOT_COMPACT_EVERY:
+        compact_snapshot(guild_id)
+
+def compact_snapshot(guild_id):
+    """Intègre à la base les deltas plus vieux que SNAPSHOT_DELETE_GRACE."""
+    _snapshot_delta_counts[guild_id] = 0
+    snap = _load_snapshot_base(guild_id)
+    if snap is None:
+        return
+    now = ts()
+    deltas = db_fetchall(
+        "SELECT id, kind, object_id, op, data_json, timestamp FROM snapshot_deltas "
+        "WHERE guild_id=? AND id>? AND timestamp<=? ORDER BY id",
+        (guild_id, snap.get("version", 0), now - SNAPSHOT_DELETE_GRACE)
+    )
+    if not deltas:
+        return
+    compacted = _apply_snapshot_deltas(snap, deltas, now)
+    with db_batch():
+        db_write(
+            "INSERT OR REPLACE INTO snapshots (guild_id, snapshot_json) VALUES (?, ?)",
+            (guild_id, json.dumps(compacted))
+        )
+        db_write("DELETE FROM snapshot_deltas WHERE guild_id=? AND id<=?", (guild_id, compacted["version"]))
+
+# Auteur des deltas : l'entrée d'audit log peut arriver avant ou après
+# l'événement gateway. Avant -> mémorisé ici et écrit avec le delta ; après ->
+# UPDATE du delta encore sans auteur (via le tampon de group commit).
+SNAPSHOT_AUTHOR_TTL = 60
+SNAPSHOT_AUDIT_ACTIONS = {
+    discord.AuditLogAction.channel_create, discord.AuditLogAction.channel_update, discord.AuditLogAction.channel_delete,
+    discord.AuditLogAction.role_create, discord.AuditLogAction.role_update, discord.AuditLogAction.role_delete,
+}
+SNAPSHOT_AUTHOR_SQL = ("UPDATE snapshot_deltas SET executor_id=? "
+                       "WHERE guild_id=? AND object_id=? AND executor_id IS NULL AND timestamp>=?")
+_snapshot_authors = OrderedDict()  # {(guild_id, object_id): (executor_id, time.monotonic())}
+
+async def note_snapshot_author(entry):
+    """Attribue à l'executor d'une entrée d'audit les deltas de l'objet visé."""
+    target_id = getattr(entry.target, "id", None)
+    if target_id is None or entry.user_id is None:
+        return
+    _remember(_snapshot_authors, (entry.guild.id, target_id), (entry.user_id, time.monotonic()))
+    await queue_write(SNAPSHOT_AUTHOR_SQL, (entry.user_id, entry.guild.id, target_id, ts() - SNAPSHOT_AUTHOR_TTL))
+
+def snapshot_author(guild_id, object_id):
+    author = _snapshot_authors.get((guild_id, object_id))
+    if author and time.monotonic() - author[1] < SNAPSHOT_AUTHOR_TTL:
+        return author[0]
+    return None
+
+def discard_snapshot_deltas(guild_id, executor_id):
+    """Oublie les deltas (non compactés) produits par un executor, ex. pendant un nuke. Retourne leur nombre."""
+    with db_batch():
+        row = db_fetchone("SELECT COUNT(*) FROM snapshot_deltas WHERE guild_id=? AND executor_id=?", (guild_id, executor_id))
+        db_write("DELETE FROM snapshot_deltas WHERE guild_id=? AND executor_id=?", (guild_id, executor_id))
+    return row[0]
+
+async def discard_executor_changes(guild, executor_id):
+    """Retire du point de restauration les changements d'un executor confiné."""
+    try:
+        await flush_pending_writes()  # attributions encore en tampon
+        count = await db_run(discard_snapshot_deltas, guild.id, executor_id)
+        if count:
+            await send_log(guild, f"🗂 {count} changement(s) de <@{executor_id}> retirés du point de restauration.")
+    except Exception:
+        traceback.print_exc()
+
+def merge_legacy_snapshot(legacy, live):
+    """
+    Convertit un ancien snapshot (indexé par nom) : base = état courant
+    (indexé par ID) + entrées anciennes sans équivalent vivant, conservées
+    telles quelles (un serveur nuké avant la mise à jour n'a que celles-là).
+    Retourne (snapshot, nombre d'entrées anciennes conservées).
+    """
+    role_names = {r["name"] for r in live["roles"]}
+    channel_keys = {(c["name"], c["type"]) for c in live["channels"]}
+    channel_names = {c["name"] for c in live["channels"]}
+    kept = 0
+    roles, channels = list(live["roles"]), list(live["channels"])
+    for r in legacy.get("roles", []):
+        if r.get("id") or r.get("name") not in role_names:
+            roles.append(r)
+            kept += 1
+    for c in legacy.get("channels", []):
+        matched = (c.get("name"), c["type"]) in channel_keys if c.get("type") else c.get("name") in channel_names
+        if c.get("id") or not matched:
+            channels.append(c)
+            kept += 1
+    return {"roles": roles, "channels": channels}, kept
+
 # ---------- STARTUP ----------
 @bot.event
+@instrumented
 async def on_ready():
     # init DB once bot ready
-    init_db()
-    print(f"[+] Bot prêt: {bot.user} (ID: {bot.user.id})")
-    # notify owner if possible
-    if OWNER_ID:
+    await db_run(init_db)
+    load_whitelists(await db_run(read_whitelists))  # lecture sur le thread DB, bascule sur la boucle
+    if CLUSTER_ID == 0:
+        start_log_maintenance()  # une seule maintenance pour la base partagée
+    await start_metrics_server()
+    await publish_cluster_guilds()
+    # bases de snapshot dès le démarrage : un premier événement "delete" ne
+    # doit pas tomber sur un serveur sans point de restauration
+    for guild in bot.guilds:
         try:
-            owner = await bot.fetch_user(OWNER_ID)
-            await owner.send(f"✅ {bot.user} est connecté !")
+            await ensure_snapshot_base(guild)
         except Exception:
-            # silent fail if owner DM blocked
-            pass
+            traceback.print_exc()
+    print(f"[+] Bot prêt: {bot.user} (ID: {bot.user.id})" + (f" — cluster {CLUSTER_ID}, shards {SHARD_IDS}/{SHARD_COUNT}" if CLUSTERED else ""))
+    # notify owner if possible (résout aussi son salon DM une fois pour toutes)
+    notify_owner(f"✅ {bot.user} est connecté sur {len(bot.guilds)} serveurs !", "info")
+
+@bot.event
+@instrumented
+async def on_guild_remove(guild):
+    # le bot a quitté le serveur : on libère sa config du cache
+    invalidate_config(guild.id)
+    _snapshot_ready.discard(guild.id)
+    if CLUSTERED:
+        await db_run(remove_cluster_guild_db, guild.id)
+    # PROTECTION DU BOT (l'audit log n'est plus lisible une fois retiré)
+    notify_owner(f"Votre bot a été **kick/banni** (ou retiré) de **{guild.name}**.", "critical")
 
 # ---------- SNAPSHOT COMMAND ----------
+def serialize_role(role):
+    return {
+        "id": role.id,
+        "name": role.name,
+        "permissions": role.permissions.value,
+        "color": role.color.value,
+        "hoist": bool(role.hoist),
+        "mentionable": bool(role.mentionable),
+        "position": role.position,
+        "managed": bool(role.managed),
+        "default": role.is_default()
+    }
+
+def serialize_channel(ch):
+    overwrites = []
+    for target, ow in ch.overwrites.items():
+        allow, deny = ow.pair()
+        overwrites.append({
+            "id": target.id,
+            "type": "role" if isinstance(target, discord.Role) else "member",
+            "allow": allow.value,
+            "deny": deny.value
+        })
+    return {
+        "id": ch.id,
+        "name": ch.name,
+        "type": str(ch.type),
+        "category": ch.category.name if ch.category else None,
+        "category_id": ch.category_id,
+        "position": ch.position,
+        "topic": getattr(ch, "topic", None),
+        "nsfw": bool(getattr(ch, "nsfw", False)),
+        "slowmode_delay": getattr(ch, "slowmode_delay", 0),
+        "bitrate": getattr(ch, "bitrate", None),
+        "user_limit": getattr(ch, "user_limit", None),
+        "overwrites": overwrites
+    }
+
+def build_snapshot(guild):
+    """Snapshot complet (rôles + salons) du serveur."""
+    return {
+        "roles": [serialize_role(r) for r in guild.roles],
+        "channels": [serialize_channel(c) for c in guild.channels]
+    }
+
 @bot.command(name="snapshot")
 async def cmd_snapshot(ctx):
     """!snapshot - sauvegarde un snapshot (roles + channels)"""
     if not is_staff(ctx):
         return await ctx.send("❌ Vous n'avez pas la permission.")
     guild = ctx.guild
-    snap = {"roles": [], "channels": []}
-    # roles (names, perms, hoist, mentionable)
-    for role in guild.roles:
-        snap["roles"].append({
-            "name": role.name,
-            "permissions": role.permissions.value,
-            "hoist": bool(role.hoist),
-            "mentionable": bool(role.mentionable)
-        })
-    # minimal channels info (name, type, category name, position)
-    for ch in guild.channels:
-        snap["channels"].append({
-            "name": ch.name,
-            "type": str(ch.type),
-            "category": ch.category.name if ch.category else None,
-            "position": ch.position
-        })
-    save_snapshot_db(guild.id, snap)
+    snap = build_snapshot(guild)
+    await db_run(save_snapshot_db, guild.id, snap)
     await ctx.send("✅ Snapshot sauvegardé.")
     await send_log(guild, f"🗂 Snapshot sauvegardé par {ctx.author}")
 
+@bot.command(name="restore")
+async def cmd_restore(ctx):
+    """!restore - recrée les rôles / salons manquants depuis le snapshot"""
+    if not is_staff(ctx):
+        return await ctx.send("❌ Vous n'avez pas la permission.")
+    await ctx.send("🔄 Restauration lancée, progression dans le canal de logs.")
+    ok = await restore_from_snapshot(ctx.guild)
+    await ctx.send("✅ Restauration terminée." if ok else "⚠️ Restauration impossible (aucun snapshot ?).")
+
+# ---------- SNAPSHOT INCRÉMENTAL ----------
+# Le snapshot suit le serveur en continu via les événements gateway (clé = ID).
+# La base complète n'est construite qu'une fois par serveur (à partir du cache).
+_snapshot_ready = set()
+
+async def ensure_snapshot_base(guild, deleted=None):
+    """
+    Construit la base du snapshot si elle n'existe pas (ou n'est qu'un ancien
+    snapshot indexé par nom). `deleted` = (kind, data) d'un objet qui vient
+    d'être supprimé et n'est donc plus dans le cache : il est ajouté à la base.
+    Retourne True si la base vient d'être créée.
+    """
+    if guild.id in _snapshot_ready:
+        return False
+    created = False
+    base = await db_run(_load_snapshot_base, guild.id)
+    legacy = base is not None and not all(e.get("id") for e in base.get("roles", []) + base.get("channels", []))
+    if base is None or legacy:
+        snap = build_snapshot(guild)
+        if deleted:
+            kind, data = deleted
+            snap["roles" if kind == "role" else "channels"].append(data)
+        if legacy:
+            snap, kept = merge_legacy_snapshot(base, snap)
+            notify_owner(f"🗂 Snapshot de **{guild.name}** converti au format par ID "
+                         f"({kept} entrée(s) de l'ancien snapshot conservées).", "info")
+        await db_run(save_snapshot_db, guild.id, snap)
+        created = True
+    _snapshot_ready.add(guild.id)
+    return created
+
+async def track_snapshot_change(guild, kind, object_id, op, data=None):
+    try:
+        created = await ensure_snapshot_base(guild, (kind, data) if op == "delete" and data else None)
+        if created and op != "delete":
+            return  # la base vient d'être construite à partir de l'état courant
+        await db_run(record_snapshot_delta, guild.id, kind, object_id, op, None if op == "delete" else data,
+                     snapshot_author(guild.id, object_id))
+    except Exception:
+        traceback.print_exc()
+
+@bot.event
+@instrumented
+async def on_guild_join(guild):
+    try:
+        if CLUSTERED:
+            await db_run(upsert_cluster_guilds_db, [cluster_guild_row(guild)])
+        await ensure_snapshot_base(guild)
+    except Exception:
+        traceback.print_exc()
+
+@bot.event
+@instrumented
+async def on_guild_role_create(role):
+    await track_snapshot_change(role.guild, "role", role.id, "upsert", serialize_role(role))
+
+@bot.event
+@instrumented
+async def on_guild_role_update(before, after):
+    await track_snapshot_change(after.guild, "role", after.id, "upsert", serialize_role(after))
+
+@bot.event
+@instrumented
+async def on_guild_channel_create(channel):
+    await track_snapshot_change(channel.guild, "channel", channel.id, "upsert", serialize_channel(channel))
+
+@bot.event
+@instrumented
+async def on_guild_channel_update(before, after):
+    await track_snapshot_change(after.guild, "channel", after.id, "upsert", serialize_channel(after))
+
 # ---------- WARN COMMANDS ----------
 @bot.command(name="warn")
 async def cmd_warn(ctx, member: discord.Member, *, reason: str = "Aucune raison"):
     """!warn <member> [raison] - ajoute un warn (requiert staff)"""
     if not is_staff(ctx):
         return await ctx.send("❌ Vous n'avez pas la permission.")
-    add_warn_db(ctx.guild.id, member.id, ctx.author.id, reason)
+    await queue_warn(ctx.guild.id, member.id, ctx.author.id, reason)
     await ctx.send(f"⚠️ {member.mention} a reçu un warn: {reason}")
     await send_log(ctx.guild, f"⚠️ WARN: {member} par {ctx.author} pour: {reason}")
     # check auto-action if threshold reached
-    cfg = load_config(ctx.guild.id)
-    warns = get_warns_db(ctx.guild.id, member.id)
+    cfg = await get_config(ctx.guild.id)
+    await flush_pending_writes()
+    warns = await db_run(get_warns_db, ctx.guild.id, member.id)
     if len(warns) >= cfg.get("warn_threshold", DEFAULT_CONFIG["warn_threshold"]):
         action = cfg.get("warn_action", DEFAULT_CONFIG["warn_action"])
         try:
             if action == "mute":
                 role = discord.utils.get(ctx.guild.roles, name="Muted")
                 if not role:
-                    role = await ctx.guild.create_role(name="Muted")
+                    with rest_timer("create_role"):
+                        role = await ctx.guild.create_role(name="Muted")
                     for channel in ctx.guild.channels:
                         try:
-                            await channel.set_permissions(role, send_messages=False)
+                            with rest_timer("channel.set_permissions"):
+                                await channel.set_permissions(role, send_messages=False)
                         except:
                             pass
-                await member.add_roles(role)
+                with rest_timer("member.add_roles"):
+                    await member.add_roles(role)
                 await ctx.send(f"🔇 {member.mention} a été mute automatiquement (warns >= {len(warns)})")
                 await send_log(ctx.guild, f"🔇 {member} mute automatiquement (warns >= {len(warns)})")
             elif action == "kick":
-                await member.kick(reason="Auto sanction warns")
+                with rest_timer("member.kick"):
+                    await member.kick(reason="Auto sanction warns")
                 await ctx.send(f"👢 {member.mention} expulsé automatiquement.")
             elif action == "ban":
-                await member.ban(reason="Auto sanction warns")
+                with rest_timer("guild.ban"):
+                    await member.ban(reason="Auto sanction warns")
                 await ctx.send(f"⛔ {member.mention} banni automatiquement.")
         except Exception:
             traceback.print_exc()
 
+WARNS_PER_PAGE = 10
+EMBED_MAX_CHARS = 6000  # limite Discord : titre + champs + footer d'un embed
+EMBED_FOOTER_RESERVE = 100
+
+def build_warns_pages(member, rows, names):
+    """Un embed par page : au plus WARNS_PER_PAGE warns et EMBED_MAX_CHARS caractères."""
+    title = f"Warns de {member}"[:256]
+    budget = EMBED_MAX_CHARS - len(title) - EMBED_FOOTER_RESERVE
+    chunks, chunk, size = [], [], 0
+    for wid, mod_id, reason, t in rows:
+        name = f"ID {wid}"
+        value = f"Par: {names.get(mod_id, mod_id)}\n{reason}\n{datetime.utcfromtimestamp(t).strftime('%d/%m/%Y %H:%M:%S')} UTC"[:1024]
+        if chunk and (len(chunk) >= WARNS_PER_PAGE or size + len(name) + len(value) > budget):
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append((name, value))
+        size += len(name) + len(value)
+    if chunk:
+        chunks.append(chunk)
+
+    pages = []
+    for fields in chunks:
+        embed = discord.Embed(title=title, color=0xe67e22)
+        for name, value in fields:
+            embed.add_field(name=name, value=value, inline=False)
+        embed.set_footer(text=f"Page {len(pages) + 1}/{len(chunks)} — {len(rows)} warns")
+        pages.append(embed)
+    return pages
+
+class PaginatorView(View):
+    """Boutons ◀ / ▶ pour parcourir une liste d'embeds (réservés à l'auteur de la commande)."""
+
+    def __init__(self, author_id, pages, timeout=180):
+        super().__init__(timeout=timeout)
+        self.author_id = author_id
+        self.pages = pages
+        self.index = 0
+        self.message = None
+        self.prev_button = Button(label="◀", style=discord.ButtonStyle.secondary)
+        self.next_button = Button(label="▶", style=discord.ButtonStyle.secondary)
+        self.prev_button.callback = self.previous
+        self.next_button.callback = self.next
+        self.add_item(self.prev_button)
+        self.add_item(self.next_button)
+        self._refresh()
+
+    def _refresh(self):
+        self.prev_button.disabled = self.index == 0
+        self.next_button.disabled = self.index >= len(self.pages) - 1
+
+    async def interaction_check(self, interaction):
+        return interaction.user.id == self.author_id
+
+    async def _show(self, interaction, index):
+        self.index = max(0, min(index, len(self.pages) - 1))
+        self._refresh()
+        with rest_timer("interaction.edit_message"):
+            await interaction.response.edit_message(embed=self.pages[self.index], view=self)
+
+    async def previous(self, interaction):
+        await self._show(interaction, self.index - 1)
+
+    async def next(self, interaction):
+        await self._show(interaction, self.index + 1)
+
+    async def on_timeout(self):
+        if self.message:
+            try:
+                with rest_timer("message.edit"):
+                    await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
 @bot.command(name="warns")
 async def cmd_warns(ctx, member: discord.Member):
     """!warns <member> - affiche les warns d'un membre"""
-    rows = get_warns_db(ctx.guild.id, member.id)
+    await flush_pending_writes()
+    rows = await db_run(get_warns_db, ctx.guild.id, member.id)
     if not rows:
         return await ctx.send(f"✅ {member} n'a aucun warn.")
-    embed = discord.Embed(title=f"Warns de {member}", color=0xe67e22)
-    for r in rows:
-        wid, mod_id, reason, t = r
-        try:
-            moderator = ctx.guild.get_member(mod_id) or await bot.fetch_user(mod_id)
-            mod_name = getattr(moderator, "display_name", str(moderator))
-        except:
-            mod_name = str(mod_id)
-        embed.add_field(name=f"ID {wid}", value=f"Par: {mod_name}\n{reason}\n{datetime.utcfromtimestamp(t).strftime('%d/%m/%Y %H:%M:%S')} UTC", inline=False)
-    await ctx.send(embed=embed)
+    # une seule résolution par modérateur distinct (cache + fetchs parallèles)
+    users = await resolve_users([r[1] for r in rows], ctx.guild)
+    names = {uid: display_user(user, uid) for uid, user in users.items()}
+    pages = build_warns_pages(member, rows, names)
+    if len(pages) == 1:
+        return await ctx.send(embed=pages[0])
+    view = PaginatorView(ctx.author.id, pages)
+    view.message = await ctx.send(embed=pages[0], view=view)
 
 @bot.command(name="clearwarns")
 async def cmd_clearwarns(ctx, member: discord.Member):
     """!clearwarns <member> - supprime tous les warns d'un membre"""
     if not is_staff(ctx):
         return await ctx.send("❌ Vous n'avez pas la permission.")
-    clear_warns_db(ctx.guild.id, member.id)
+    await flush_pending_writes()
+    await db_run(clear_warns_db, ctx.guild.id, member.id)
     await ctx.send(f"✅ Warns supprimés pour {member}.")
     await send_log(ctx.guild, f"🧾 Warns clear pour {member} par {ctx.author}")
 
 # ---------- ANTI-RAID (join flood simple) ----------
+# Fenêtre glissante en mémoire : pour chaque serveur, un ring buffer des
+# `join_limit` derniers joins (time.monotonic). Le seuil est atteint quand le
+# plus ancien des `join_limit` joins est encore dans la fenêtre. Aucun accès DB.
+join_windows = {}  # {guild_id: deque(maxlen=join_limit)}
+lockdowns = {}     # {guild_id: fin du lockdown (time.monotonic)}
+
+def record_join(guild_id, limit, window):
+    """Enregistre un join et retourne True si `limit` joins sont tombés dans `window` secondes."""
+    now = time.monotonic()
+    dq = join_windows.get(guild_id)
+    if dq is None or dq.maxlen != limit:
+        dq = join_windows[guild_id] = deque(dq or (), maxlen=limit)
+    dq.append(now)
+    return len(dq) >= limit and now - dq[0] < window
+
+def is_locked_down(guild_id):
+    until = lockdowns.get(guild_id)
+    if until is None:
+        return False
+    if time.monotonic() >= until:
+        lockdowns.pop(guild_id, None)
+        return False
+    return True
+
+def start_lockdown(guild_id, duration):
+    lockdowns[guild_id] = time.monotonic() + duration
+
 @bot.event
+@instrumented
 async def on_member_join(member):
     try:
         guild = member.guild
-        cfg = load_config(guild.id)
+        cfg = await get_config(guild.id)
         # always log join
         await send_log(guild, f"⇢ Member joined: {member} (ID: {member.id})")
         if not cfg.get("antiraid", False):
             return
-        now = ts()
-        tmp = cfg.get("_joins_tmp", [])
-        tmp.append(now)
         window = cfg.get("join_window", DEFAULT_CONFIG["join_window"])
-        # keep only items within window (seconds)
-        tmp = [t for t in tmp if now - t < window]
-        cfg["_joins_tmp"] = tmp
-        save_config(guild.id, cfg)
-        # if threshold reached, take action
-        if len(tmp) >= cfg.get("join_limit", DEFAULT_CONFIG["join_limit"]):
-            try:
-                await member.ban(reason="Anti-raid: join flood")
-                await send_log(guild, f"⚠️ ANTI-RAID: {member} banni automatiquement ({len(tmp)} joins en {window}s)")
-            except Exception:
-                traceback.print_exc()
+        limit = cfg.get("join_limit", DEFAULT_CONFIG["join_limit"])
+        flood = record_join(guild.id, limit, window)
+
+        if is_locked_down(guild.id):
+            reason = "Anti-raid: lockdown"
+        elif flood:
+            reason = "Anti-raid: join flood"
+            duration = cfg.get("lockdown_duration", DEFAULT_CONFIG["lockdown_duration"])
+            if duration > 0:
+                start_lockdown(guild.id, duration)
+                await send_log(guild, f"🔒 ANTI-RAID: lockdown activé pour {duration}s ({limit} joins en moins de {window}s)")
+        else:
+            return
+
+        try:
+            with rest_timer("guild.ban"):
+                await member.ban(reason=reason)
+            await send_log(guild, f"⚠️ ANTI-RAID: {member} banni automatiquement ({reason})")
+        except Exception:
+            traceback.print_exc()
     except Exception:
         traceback.print_exc()
 
+@bot.command(name="lockdown")
+async def cmd_lockdown(ctx, state: str = "on"):
+    """!lockdown [on/off] - bannit tout nouvel arrivant tant que le lockdown est actif"""
+    if not is_staff(ctx):
+        return await ctx.send("❌ Vous n'avez pas la permission.")
+    if state.lower() in ("off", "0", "false", "no"):
+        lockdowns.pop(ctx.guild.id, None)
+        await ctx.send("🔓 Lockdown désactivé.")
+        await send_log(ctx.guild, f"🔓 Lockdown désactivé par {ctx.author}")
+        return
+    cfg = await get_config(ctx.guild.id)
+    duration = cfg.get("lockdown_duration", DEFAULT_CONFIG["lockdown_duration"]) or DEFAULT_CONFIG["lockdown_duration"]
+    start_lockdown(ctx.guild.id, duration)
+    await ctx.send(f"🔒 Lockdown activé pour {duration}s.")
+    await send_log(ctx.guild, f"🔒 Lockdown activé par {ctx.author} ({duration}s)")
+
+@bot.command(name="set_lockdown_duration")
+async def cmd_set_lockdown_duration(ctx, seconds: int):
+    """!set_lockdown_duration <seconds> - durée du lockdown auto après un flood (0 = désactivé)"""
+    if not is_staff(ctx):
+        return await ctx.send("❌ Vous n'avez pas la permission.")
+    cfg = await get_config(ctx.guild.id)
+    cfg["lockdown_duration"] = max(0, seconds)
+    await db_run(save_config, ctx.guild.id, cfg)
+    await ctx.send(f"✅ Durée du lockdown anti-raid réglée à {cfg['lockdown_duration']}s.")
+
 # ============================================
 # FIN PARTIE 2 / 7
 # ============================================
@@ -377,76 +1531,208 @@ async def on_member_join(member):
 # ============================================
 
 # In-memory tracker déjà déclaré en PARTIE 2:
-action_trackers = {}  
-# {guild_id: {executor_id: {
-#   "ban":[], 
-#   "kick":[], 
-#   "channel_del":[], 
-#   "role_del":[],
-#   "role_add_member":[],
-#   "role_remove_member":[]
-# }}}
+# {guild_id: {executor_id: ActionTracker}}
+ACTION_KINDS = ("ban", "kick", "channel_del", "role_del", "role_add_member", "role_remove_member")
+TRACKER_RING_SIZE = 256        # actions max gardées par executor
+TRACKER_IDLE_TTL = 3600        # executor oublié après 1h sans action
+TRACKER_SWEEP_INTERVAL = 300
+_last_tracker_sweep = 0.0
+
+class ActionTracker:
+    """
+    Actions récentes d'un executor : un ring buffer borné de (timestamp, type)
+    + un compteur par type. Ajout et expiration en O(1) amorti.
+    """
+    __slots__ = ("events", "counts", "last_seen")
+
+    def __init__(self):
+        self.events = deque()
+        self.counts = dict.fromkeys(ACTION_KINDS, 0)
+        self.last_seen = 0.0
+
+    def add(self, kind, now):
+        if len(self.events) >= TRACKER_RING_SIZE:
+            _, old = self.events.popleft()
+            self.counts[old] -= 1
+        self.events.append((now, kind))
+        self.counts[kind] += 1
+        self.last_seen = now
+
+    def expire(self, now, window):
+        """Retire les actions hors fenêtre et retourne le total restant."""
+        events = self.events
+        while events and now - events[0][0] >= window:
+            _, old = events.popleft()
+            self.counts[old] -= 1
+        return len(events)
+
+    def snapshot(self):
+        """{type: [timestamps]} pour les rapports."""
+        snap = {k: [] for k in ACTION_KINDS}
+        for t, kind in self.events:
+            snap[kind].append(t)
+        return snap
+
+def sweep_action_trackers(now=None):
+    """Oublie les executors inactifs et les serveurs sans tracker."""
+    global _last_tracker_sweep
+    now = now or time.time()
+    _last_tracker_sweep = now
+    for guild_id in list(action_trackers):
+        executors = action_trackers[guild_id]
+        for executor_id in [e for e, t in executors.items() if now - t.last_seen > TRACKER_IDLE_TTL]:
+            del executors[executor_id]
+        if not executors:
+            del action_trackers[guild_id]
+
+# ---------- ATTRIBUTION (audit log) ----------
+# Source principale : l'événement gateway on_audit_log_entry_create.
+# Les watchers (ban, remove, channel/role delete, role update) ne font plus
+# d'appel REST : ils programment un fallback qui ne lit l'audit log via REST
+# que si aucune entrée gateway n'est arrivée après AUDIT_FALLBACK_DELAY.
+AUDIT_FALLBACK_DELAY = float(os.getenv("AUDIT_FALLBACK_DELAY", "3"))
+AUDIT_MEMORY = 10000
+
+AUDIT_KINDS = {
+    discord.AuditLogAction.ban: "ban",
+    discord.AuditLogAction.kick: "kick",
+    discord.AuditLogAction.channel_delete: "channel_del",
+    discord.AuditLogAction.role_delete: "role_del",
+    discord.AuditLogAction.member_role_update: "member_role_update",
+}
 
-@bot.event
-async def on_member_update(before, after):
-    try:
-        if before.roles == after.roles:
+_seen_audit_entries = OrderedDict()  # {entry_id: None}
+_attributed_targets = OrderedDict()  # {(guild_id, action, target_id): time.monotonic()}
+_gateway_audit_seen = {}             # {guild_id: time.monotonic()} dernière entrée gateway reçue
+AUDIT_GATEWAY_TRUST = 3600
+audit_stats = {"gateway": 0, "rest": 0, "unattributed": 0}
+audit_latencies = deque(maxlen=1000)  # secondes entre l'action et son attribution
+
+def _remember(store, key, value=None):
+    store[key] = value
+    store.move_to_end(key)
+    while len(store) > AUDIT_MEMORY:
+        store.popitem(last=False)
+
+def latency_summary(samples):
+    """Retourne (p50, p99, max) d'une série de latences, en secondes."""
+    if not samples:
+        return (0.0, 0.0, 0.0)
+    lat = sorted(samples)
+    return (lat[len(lat) // 2], lat[min(len(lat) - 1, int(len(lat) * 0.99))], lat[-1])
+
+async def process_audit_entry(entry, source):
+    """Pipeline unique d'attribution : tracker anti-nuke, logs, protection owner."""
+    guild = entry.guild
+    if entry.id in _seen_audit_entries:
+        return
+    _remember(_seen_audit_entries, entry.id)
+    target_id = getattr(entry.target, "id", None)
+    _remember(_attributed_targets, (guild.id, entry.action, target_id), time.monotonic())
+
+    audit_stats[source] += 1
+    if source == "gateway":
+        _gateway_audit_seen[guild.id] = time.monotonic()
+    latency = max(0.0, (discord.utils.utcnow() - entry.created_at).total_seconds())
+    audit_latencies.append(latency)
+    if METRICS_ENABLED:
+        observe("bot_audit_latency_seconds", source, latency)
+
+    executor_id = entry.user_id
+    if executor_id is None or (bot.user and executor_id == bot.user.id):
+        return
+    executor = entry.user or guild.get_member(executor_id)
+    exec_str = str(executor) if executor else f"<@{executor_id}>"
+    target_str = str(entry.target) if isinstance(entry.target, (discord.User, discord.Member)) else f"<@{target_id}>"
+    kind = AUDIT_KINDS[entry.action]
+    tracker = ensure_action_tracker(guild.id, executor_id)
+    now = time.time()
+
+    if kind == "ban":
+        tracker.add("ban", now)
+        await send_log(guild, f"🔨 Ban détecté: {target_str} par {exec_str}")
+        if target_id == OWNER_ID:
+            await protect_owner(guild, "ban", exec_str)
+    elif kind == "kick":
+        tracker.add("kick", now)
+        await send_log(guild, f"👢 Kick détecté: {target_str} par {exec_str}")
+        if target_id == OWNER_ID:
+            await protect_owner(guild, "kick", exec_str)
+    elif kind == "channel_del":
+        tracker.add("channel_del", now)
+        name = getattr(entry.before, "name", None) or target_id
+        await send_log(guild, f"🗑️ Channel supprimé: {name} par {exec_str}")
+    elif kind == "role_del":
+        tracker.add("role_del", now)
+        name = getattr(entry.before, "name", None) or target_id
+        await send_log(guild, f"🗑️ Rôle supprimé: {name} par {exec_str}")
+    elif kind == "member_role_update":
+        # Ignore owner / whitelist
+        if executor_id == OWNER_ID or is_whitelisted(guild.id, executor_id):
             return
+        if getattr(entry.after, "roles", None):
+            tracker.add("role_add_member", now)
+            await send_log(guild, f"🎭 Rôle AJOUTÉ abusif: {exec_str} → {target_str}")
+        if getattr(entry.before, "roles", None):
+            tracker.add("role_remove_member", now)
+            await send_log(guild, f"🎭 Rôle RETIRÉ abusif: {exec_str} → {target_str}")
 
-        guild = after.guild
+    await check_and_handle_nuke(guild, executor_id)
 
-        async for entry in guild.audit_logs(
-            limit=1,
-            action=discord.AuditLogAction.member_role_update
-        ):
-            if entry.target.id != after.id:
-                return
-
-            executor = entry.user
-
-            # Ignore owner
-            if executor.id == OWNER_ID:
-                return
+def expect_audit_entry(guild, action, target_id, match_target=True):
+    """Programme le fallback REST si l'entrée gateway correspondante n'arrive pas."""
+    asyncio.create_task(_audit_fallback(guild, action, target_id, match_target, time.monotonic()))
 
-            # Ignore whitelist
-            if is_whitelisted(guild.id, executor.id):
+async def _audit_fallback(guild, action, target_id, match_target, observed):
+    try:
+        await asyncio.sleep(AUDIT_FALLBACK_DELAY)
+        seen = _attributed_targets.get((guild.id, action, target_id))
+        if seen is not None and seen >= observed - AUDIT_FALLBACK_DELAY:
+            return
+        # Le gateway livre les entrées pour ce serveur : pas d'entrée = rien à attribuer
+        # (ex. un départ volontaire n'a pas d'entrée kick), inutile d'appeler l'API.
+        last_gateway = _gateway_audit_seen.get(guild.id)
+        if last_gateway is not None and time.monotonic() - last_gateway < AUDIT_GATEWAY_TRUST:
+            if action != discord.AuditLogAction.kick:
+                audit_stats["unattributed"] += 1
+            return
+        with rest_timer("guild.audit_logs"):
+            entries = [e async for e in guild.audit_logs(limit=6, action=action)]
+        for entry in entries:
+            if not match_target or getattr(entry.target, "id", None) == target_id:
+                if entry.action in SNAPSHOT_AUDIT_ACTIONS:
+                    await note_snapshot_author(entry)
+                await process_audit_entry(entry, "rest")
                 return
+        audit_stats["unattributed"] += 1
+    except Exception:
+        traceback.print_exc()
 
-            now = ts()
-            tracker = ensure_action_tracker(guild.id, executor.id)
-
-            # Rôle ajouté
-            if len(after.roles) > len(before.roles):
-                tracker["role_add_member"].append(now)
-                await send_log(
-                    guild,
-                    f"🎭 Rôle AJOUTÉ abusif: {executor} → {after}"
-                )
-
-            # Rôle retiré
-            if len(after.roles) < len(before.roles):
-                tracker["role_remove_member"].append(now)
-                await send_log(
-                    guild,
-                    f"🎭 Rôle RETIRÉ abusif: {executor} → {after}"
-                )
-
-            await check_and_handle_nuke(guild, executor.id)
-            break
-
+@bot.event
+@instrumented
+async def on_audit_log_entry_create(entry):
+    try:
+        if entry.action in SNAPSHOT_AUDIT_ACTIONS:
+            await note_snapshot_author(entry)
+        if entry.action in AUDIT_KINDS:
+            await process_audit_entry(entry, "gateway")
     except Exception:
         traceback.print_exc()
 
+@bot.event
+@instrumented
+async def on_member_update(before, after):
+    if before.roles != after.roles:
+        expect_audit_entry(after.guild, discord.AuditLogAction.member_role_update, after.id)
+
 def ensure_action_tracker(guild_id, executor_id):
+    if time.time() - _last_tracker_sweep > TRACKER_SWEEP_INTERVAL:
+        sweep_action_trackers()
     g = action_trackers.setdefault(guild_id, {})
-    return g.setdefault(executor_id, {
-        "ban": [],
-        "kick": [],
-        "channel_del": [],
-        "role_del": [],
-        "role_add_member": [],
-        "role_remove_member": []
-    })
+    tracker = g.get(executor_id)
+    if tracker is None:
+        tracker = g[executor_id] = ActionTracker()
+    return tracker
 
 async def generate_basic_nuke_report(guild, executor_id, snapshot):
     """
@@ -455,7 +1741,7 @@ async def generate_basic_nuke_report(guild, executor_id, snapshot):
     """
     try:
         total = sum(len(v) for v in snapshot.values())
-        executor = guild.get_member(executor_id) or await bot.fetch_user(executor_id)
+        executor = await resolve_user(executor_id, guild)
         exec_str = str(executor) if executor else f"<@{executor_id}> ({executor_id})"
         msg = f"🚨 **Anti-Nuke détecté** sur `{guild.name}` — Executor: {exec_str} — Actions: {total}\n"
         for k, v in snapshot.items():
@@ -466,23 +1752,10 @@ async def generate_basic_nuke_report(guild, executor_id, snapshot):
             "counts": {k: len(v) for k, v in snapshot.items()},
             "generated_at": ts()
         }
-        try:
-            conn = db_connect()
-            cur = conn.cursor()
-            cur.execute("INSERT INTO logs (guild_id, event_type, event_json, timestamp) VALUES (?, ?, ?, ?)",
-                        (guild.id, "anti_nuke_basic", json.dumps(persist_payload), int(datetime.utcnow().timestamp())))
-            conn.commit()
-            conn.close()
-        except Exception:
-            traceback.print_exc()
+        await queue_log_event(guild.id, "anti_nuke_basic", persist_payload)
         await send_log(guild, msg)
-        # DM owner
-        if OWNER_ID:
-            try:
-                owner = await bot.fetch_user(OWNER_ID)
-                await owner.send(f"[Anti-Nuke] {guild.name} — Executor: {exec_str} — actions: {total}")
-            except:
-                pass
+        # DM owner (digest)
+        notify_owner(f"[Anti-Nuke] {guild.name} — Executor: {exec_str} — actions: {total}", "critical")
     except Exception:
         traceback.print_exc()
 
@@ -492,7 +1765,7 @@ async def check_and_handle_nuke(guild, executor_id):
     si seuil dépassé, génère rapport et punit l'executor.
     """
     try:
-        cfg = load_config(guild.id)
+        cfg = await get_config(guild.id)
         threshold = cfg.get("nuke_actions_limit", DEFAULT_CONFIG["nuke_actions_limit"])
         window = cfg.get("nuke_window", DEFAULT_CONFIG.get("nuke_window", 10))
     except Exception:
@@ -500,94 +1773,46 @@ async def check_and_handle_nuke(guild, executor_id):
         window = 10
 
     tracker = action_trackers.get(guild.id, {}).get(executor_id)
-    if not tracker:
+    if tracker is None:
         return False
 
-    now = ts()
-    snapshot = {}
-    total = 0
     # cleanup and count within window
-    for k in list(tracker.keys()):
-        tracker[k] = [t for t in tracker[k] if now - t < window]
-        snapshot[k] = list(tracker[k])
-        total += len(tracker[k])
+    total = tracker.expire(time.time(), window)
 
     if total >= threshold:
-        # generate basic report & persist
-        await generate_basic_nuke_report(guild, executor_id, snapshot)
-        # try to punish (ban) executor (best-effort)
-        try:
-            executor_member = guild.get_member(executor_id)
-            if executor_member:
-                # do not ban owner
-                if executor_member.id == OWNER_ID:
-                    await send_log(guild, f"⚠️ Executor identifié comme OWNER ({OWNER_ID}), aucune action punitive.")
-                else:
-                    try:
-                        # attempt to strip elevated roles (best-effort)
-                        for r in list(executor_member.roles):
-                            if r.permissions.administrator or r.permissions.manage_guild:
-                                try:
-                                    await executor_member.remove_roles(r)
-                                except:
-                                    pass
-                    except:
-                        pass
-                    try:
-                        await guild.ban(executor_member, reason="Auto anti-nuke")
-                        await send_log(guild, f"⛔ Executor {executor_member} banni par anti-nuke.")
-                    except Exception:
-                        traceback.print_exc()
-            else:
-                # executor not in cache — try to fetch as user and ban by id (best-effort)
-                try:
-                    user = await bot.fetch_user(executor_id)
-                    try:
-                        await guild.ban(user, reason="Auto anti-nuke (by id)")
-                        await send_log(guild, f"⛔ Executor {user} banni par id (anti-nuke).")
-                    except:
-                        pass
-                except:
-                    pass
-        except Exception:
-            traceback.print_exc()
-        # attempt minimal restore if snapshot exists (snapshot restore implemented later)
-        try:
-            # Clear tracker for executor
-            action_trackers[guild.id].pop(executor_id, None)
-        except:
-            pass
+        detected_at = time.monotonic()
+        snapshot = tracker.snapshot()
+        # Clear tracker for executor (évite un second déclenchement pendant la réponse)
+        action_trackers.get(guild.id, {}).pop(executor_id, None)
+        # confinement, rapport et purge des deltas de l'executor (ils ne doivent
+        # pas entrer dans le point de restauration) en parallèle : le ban part en
+        # premier et n'attend jamais la file du thread DB
+        await run_guild_actions(
+            guild.id,
+            contain_executor(guild, executor_id, "Auto anti-nuke", detected_at),
+            generate_basic_nuke_report(guild, executor_id, snapshot),
+            discard_executor_changes(guild, executor_id)
+        )
         return True
 
     return False
 
 # ---------- WATCHER: bans ----------
 @bot.event
+@instrumented
 async def on_member_ban(guild, user):
     """
-    Fired when a user is banned; read audit logs to find who did it
+    Fired when a user is banned; attribution via the audit log pipeline
     """
     try:
-        async for entry in guild.audit_logs(limit=6, action=discord.AuditLogAction.ban):
-            if entry.target and getattr(entry.target, "id", None) == user.id:
-                executor = entry.user
-                now = ts()
-                tracker = ensure_action_tracker(guild.id, executor.id)
-                tracker["ban"].append(now)
-                await send_log(guild, f"🔨 Ban détecté: {user} par {executor}")
-                await check_and_handle_nuke(guild, executor.id)
-                break
+        expect_audit_entry(guild, discord.AuditLogAction.ban, user.id)
         # owner protection: if target was owner -> try to unban
         if user.id == OWNER_ID:
             try:
-                await guild.unban(user)
+                with rest_timer("guild.unban"):
+                    await guild.unban(user)
                 await send_log(guild, f"⚠️ Owner ({user}) a été banni — deban automatique.")
-                if OWNER_ID:
-                    try:
-                        owner = await bot.fetch_user(OWNER_ID)
-                        await owner.send(f"⚠️ Vous avez été banni de {guild.name} — deban automatique effectué.")
-                    except:
-                        pass
+                notify_owner(f"Vous avez été banni de {guild.name} — deban automatique effectué.", "critical")
             except:
                 traceback.print_exc()
     except Exception:
@@ -595,63 +1820,40 @@ async def on_member_ban(guild, user):
 
 # ---------- WATCHER: member remove (kick detection) ----------
 @bot.event
+@instrumented
 async def on_member_remove(member):
     try:
         guild = member.guild
         # log leave
         await send_log(guild, f"⇠ Member left: {member} (ID: {member.id})")
-        # check recent audit logs for a kick entry
-        async for entry in guild.audit_logs(limit=6, action=discord.AuditLogAction.kick):
-            if entry.target and getattr(entry.target, "id", None) == member.id:
-                executor = entry.user
-                now = ts()
-                tracker = ensure_action_tracker(guild.id, executor.id)
-                tracker["kick"].append(now)
-                await send_log(guild, f"👢 Kick détecté: {member} par {executor}")
-                await check_and_handle_nuke(guild, executor.id)
-                break
+        # kick éventuel : attribué par le pipeline audit log
+        expect_audit_entry(guild, discord.AuditLogAction.kick, member.id)
         # owner protection: if owner removed
         if member.id == OWNER_ID:
             await send_log(guild, f"⚠️ Owner ({member}) a été expulsé/est parti du serveur.")
-            if OWNER_ID:
-                try:
-                    owner = await bot.fetch_user(OWNER_ID)
-                    await owner.send(f"⚠️ Vous avez été expulsé/avez quitté {guild.name}.")
-                except:
-                    pass
+            notify_owner(f"Vous avez été expulsé/avez quitté {guild.name}.", "warning")
     except Exception:
         traceback.print_exc()
 
 # ---------- WATCHER: channel delete ----------
 @bot.event
+@instrumented
 async def on_guild_channel_delete(channel):
     try:
-        guild = channel.guild
-        async for entry in guild.audit_logs(limit=6, action=discord.AuditLogAction.channel_delete):
-            executor = entry.user
-            now = ts()
-            tracker = ensure_action_tracker(guild.id, executor.id)
-            tracker["channel_del"].append(now)
-            await send_log(guild, f"🗑️ Channel supprimé: {channel.name} par {executor}")
-            await check_and_handle_nuke(guild, executor.id)
-            break
+        await track_snapshot_change(channel.guild, "channel", channel.id, "delete",
+                                   None if channel.guild.id in _snapshot_ready else serialize_channel(channel))
+        expect_audit_entry(channel.guild, discord.AuditLogAction.channel_delete, channel.id, match_target=False)
     except Exception:
         traceback.print_exc()
 
 # ---------- WATCHER: role delete ----------
 @bot.event
+@instrumented
 async def on_guild_role_delete(role):
     try:
-        guild = role.guild
-        async for entry in guild.audit_logs(limit=6, action=discord.AuditLogAction.role_delete):
-            if entry.target and getattr(entry.target, "id", None) == role.id:
-                executor = entry.user
-                now = ts()
-                tracker = ensure_action_tracker(guild.id, executor.id)
-                tracker["role_del"].append(now)
-                await send_log(guild, f"🗑️ Rôle supprimé: {role.name} par {executor}")
-                await check_and_handle_nuke(guild, executor.id)
-                break
+        await track_snapshot_change(role.guild, "role", role.id, "delete",
+                                   None if role.guild.id in _snapshot_ready else serialize_role(role))
+        expect_audit_entry(role.guild, discord.AuditLogAction.role_delete, role.id)
     except Exception:
         traceback.print_exc()
 
@@ -664,37 +1866,88 @@ async def on_guild_role_delete(role):
 # RAPPORT ANTI-NUKE, PUNITION, RESTAURATION, PERSISTENCE LOGS
 # ============================================
 
-# ---------- Helpers DB pour logs (crée la table si besoin) ----------
-def ensure_logs_table():
-    conn = db_connect()
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            guild_id INTEGER,
-            event_type TEXT,
-            event_json TEXT,
-            timestamp INTEGER
-        )
-    """)
-    conn.commit()
-    conn.close()
+# ---------- Helpers DB pour logs ----------
+LOG_INSERT_SQL = "INSERT INTO logs (guild_id, event_type, event_json, timestamp) VALUES (?, ?, ?, ?)"
 
-def persist_log_event(guild_id, event_type, payload):
-    """Persist an arbitrary event payload into the logs table (JSON)."""
+async def queue_log_event(guild_id, event_type, payload):
+    """Persist an arbitrary event payload into the logs table (JSON), through the group-commit buffer."""
     try:
-        ensure_logs_table()
-        conn = db_connect()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO logs (guild_id, event_type, event_json, timestamp) VALUES (?, ?, ?, ?)",
-            (guild_id, event_type, json.dumps(payload, default=str), int(datetime.utcnow().timestamp()))
-        )
-        conn.commit()
-        conn.close()
+        await queue_write(LOG_INSERT_SQL, (guild_id, event_type, json.dumps(payload, default=str), ts()))
     except Exception:
         traceback.print_exc()
 
+# ---------- RÉTENTION + ROLLUP DES LOGS ----------
+# Tâche de fond : agrège les nouvelles lignes de logs dans les tables
+# logs_rollup_hourly / logs_rollup_daily (curseur = dernier id agrégé), puis
+# supprime par petits lots les lignes déjà agrégées plus vieilles que
+# LOG_RETENTION_DAYS. Chaque lot est une écriture courte sur le thread DB.
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "90"))
+LOG_MAINTENANCE_INTERVAL = 600
+LOG_MAINTENANCE_BATCH = 500
+_log_maintenance_task = None
+
+def _get_state(key, default=0):
+    row = db_fetchone("SELECT value FROM maintenance_state WHERE key=?", (key,))
+    return row[0] if row else default
+
+def rollup_logs_batch(batch=LOG_MAINTENANCE_BATCH * 10):
+    """Agrège le prochain lot de logs. Retourne le nombre de lignes agrégées."""
+    cursor = _get_state("logs_rollup_cursor")
+    row = db_fetchone(
+        "SELECT MAX(id), COUNT(*) FROM (SELECT id FROM logs WHERE id>? ORDER BY id LIMIT ?)", (cursor, batch)
+    )
+    upto, count = row
+    if not count:
+        return 0
+    with db_batch():
+        for table, size in (("logs_rollup_hourly", 3600), ("logs_rollup_daily", 86400)):
+            db_write(f"""
+                INSERT INTO {table} (guild_id, event_type, bucket, count)
+                SELECT guild_id, event_type, (timestamp / {size}) * {size}, COUNT(*)
+                FROM logs WHERE id>? AND id<=? GROUP BY 1, 2, 3
+                ON CONFLICT (guild_id, event_type, bucket) DO UPDATE SET count = count + excluded.count
+            """, (cursor, upto))
+        db_write("INSERT OR REPLACE INTO maintenance_state (key, value) VALUES ('logs_rollup_cursor', ?)", (upto,))
+    return count
+
+def prune_logs_batch(cutoff, batch=LOG_MAINTENANCE_BATCH):
+    """Supprime un lot de logs agrégés plus vieux que cutoff. Retourne le nombre supprimé."""
+    cursor = _get_state("logs_rollup_cursor")
+    return db_write(
+        "DELETE FROM logs WHERE id IN (SELECT id FROM logs WHERE timestamp<? AND id<=? ORDER BY timestamp LIMIT ?)",
+        (cutoff, cursor, batch)
+    )
+
+def get_log_counts(guild_id, since, granularity="daily"):
+    """{event_type: total} depuis `since`, lu dans les agrégats."""
+    table = "logs_rollup_hourly" if granularity == "hourly" else "logs_rollup_daily"
+    rows = db_fetchall(
+        f"SELECT event_type, SUM(count) FROM {table} WHERE guild_id=? AND bucket>=? GROUP BY event_type ORDER BY 2 DESC",
+        (guild_id, since)
+    )
+    return dict(rows)
+
+async def run_log_maintenance():
+    while await db_run(rollup_logs_batch):
+        await asyncio.sleep(0)
+    if LOG_RETENTION_DAYS > 0:
+        cutoff = ts() - LOG_RETENTION_DAYS * 86400
+        while await db_run(prune_logs_batch, cutoff) >= LOG_MAINTENANCE_BATCH:
+            await asyncio.sleep(0.1)
+
+async def log_maintenance_loop():
+    while True:
+        try:
+            await run_log_maintenance()
+        except Exception:
+            traceback.print_exc()
+        await asyncio.sleep(LOG_MAINTENANCE_INTERVAL)
+
+def start_log_maintenance():
+    global _log_maintenance_task
+    if _log_maintenance_task is None or _log_maintenance_task.done():
+        _log_maintenance_task = asyncio.create_task(log_maintenance_loop())
+
 # ---------- Human readable time ----------
 def human_time_from_ts(ts_int):
     try:
@@ -703,98 +1956,275 @@ def human_time_from_ts(ts_int):
         return str(ts_int)
 
 # ---------- PUNISH EXECUTOR ----------
-async def punish_executor_real(guild, executor_member, snapshot_counts):
+# Moteur de réponse : ban immédiat par id (ni fetch, ni retrait de rôles
+# préalable). Si le ban échoue, tous les rôles sensibles sont retirés en un
+# seul member.edit(roles=...). Les actions indépendantes d'un même serveur
+# tournent en parallèle sous un sémaphore par serveur.
+NUKE_ACTION_CONCURRENCY = 4
+_guild_action_sems = {}
+containment_stats = {"contained": 0, "failed": 0}
+containment_latencies = deque(maxlen=1000)  # secondes entre détection et confinement
+
+async def run_guild_actions(guild_id, *coros):
+    """Exécute des actions indépendantes en parallèle (au plus NUKE_ACTION_CONCURRENCY à la fois)."""
+    sem = _guild_action_sems.get(guild_id)
+    if sem is None:
+        sem = _guild_action_sems[guild_id] = asyncio.Semaphore(NUKE_ACTION_CONCURRENCY)
+
+    async def guarded(coro):
+        async with sem:
+            return await coro
+
+    return await asyncio.gather(*(guarded(c) for c in coros), return_exceptions=True)
+
+def is_sensitive_role(role):
+    perms = role.permissions
+    return perms.administrator or perms.manage_guild or perms.manage_roles or perms.ban_members or perms.kick_members
+
+async def contain_executor(guild, executor_id, reason, detected_at=None):
+    """
+    Confine l'executor le plus vite possible : ban par id, sinon retrait des
+    rôles sensibles en un seul appel. Retourne True si confiné.
+    """
+    # never punish owner
+    if OWNER_ID and executor_id == OWNER_ID:
+        await send_log(guild, f"⚠️ Executor identifié comme OWNER ({OWNER_ID}), aucune action punitive.")
+        return False
+    detected_at = detected_at or time.monotonic()
+    contained = False
+    try:
+        with rest_timer("guild.ban"):
+            await guild.ban(discord.Object(id=executor_id), reason=reason)
+        contained = "ban"
+        await send_log(guild, f"⛔ Executor <@{executor_id}> banni. Raison: {reason}")
+    except Exception:
+        traceback.print_exc()
+        member = await get_or_fetch_member(guild, executor_id)
+        if member:
+            keep = [r for r in member.roles if not r.is_default() and (r.managed or not is_sensitive_role(r))]
+            if len(keep) < len(member.roles) - 1:
+                try:
+                    with rest_timer("member.edit"):
+                        await member.edit(roles=keep, reason="Anti-nuke: removal of sensitive roles")
+                    contained = "roles"
+                    await send_log(guild, f"⚠️ Ban impossible, rôles sensibles retirés à {member}.")
+                except Exception:
+                    traceback.print_exc()
+        if not contained:
+            await send_log(guild, f"⚠️ Impossible de bannir <@{executor_id}> (permissions manquantes?)")
+
+    if contained:
+        containment_stats["contained"] += 1
+        latency = time.monotonic() - detected_at
+        containment_latencies.append(latency)
+        if METRICS_ENABLED:
+            observe("bot_containment_latency_seconds", contained, latency)
+    else:
+        containment_stats["failed"] += 1
+    return bool(contained)
+
+async def punish_executor_real(guild, executor_member, snapshot_counts, detected_at=None):
     """
-    Try to remove sensitive roles then ban the executor. Best-effort: skip if owner or highest role.
+    Ban the executor (remove sensitive roles only if the ban fails).
     snapshot_counts used for logging the reason.
     """
     try:
         if executor_member is None:
             return
-        # never punish owner
-        if OWNER_ID and executor_member.id == OWNER_ID:
-            await send_log(guild, f"⚠️ Executor {executor_member} identifié comme OWNER — punition ignorée.")
-            return
+        reason = f"Anti-nuke auto-ban (actions: {snapshot_counts})"
+        await contain_executor(guild, executor_member.id, reason, detected_at)
+    except Exception:
+        traceback.print_exc()
 
-        # Attempt to remove roles with dangerous perms (administrator/manage_guild/manage_roles)
+# ---------- RESTORE FROM SNAPSHOT (roles + channels) ----------
+# Planificateur : diff snapshot / serveur, puis recréation par couches
+# dépendantes (rôles → catégories → salons avec overwrites), chaque couche en
+# parallèle (RESTORE_CONCURRENCY requêtes simultanées, discord.py gère les
+# buckets de rate limit), puis une seule mise à jour groupée des positions.
+# Les éléments sont associés par ID, ou par nom pour les anciens snapshots.
+RESTORE_CONCURRENCY = 5
+
+def _snap_key(data):
+    return data.get("id") or data.get("name")
+
+def plan_restore(guild, snap):
+    """Retourne {"roles", "categories", "channels"} à recréer + les correspondances existantes."""
+    roles_by_id = {r.id: r for r in guild.roles}
+    roles_by_name = {r.name: r for r in guild.roles}
+    channels_by_id = {c.id: c for c in guild.channels}
+    channels_by_name = {(c.name, str(c.type)): c for c in guild.channels}
+
+    plan = {"roles": [], "categories": [], "channels": [], "role_map": {}, "channel_map": {}}
+    for rdata in snap.get("roles", []):
+        if rdata.get("default") or rdata.get("name") == "@everyone":
+            plan["role_map"][_snap_key(rdata)] = guild.default_role
+            continue
+        live = roles_by_id.get(rdata.get("id")) or roles_by_name.get(rdata.get("name"))
+        if live:
+            plan["role_map"][_snap_key(rdata)] = live
+        elif rdata.get("name") and not rdata.get("managed"):
+            plan["roles"].append(rdata)
+
+    for cdata in snap.get("channels", []):
+        live = channels_by_id.get(cdata.get("id")) or channels_by_name.get((cdata.get("name"), cdata.get("type", "")))
+        if live:
+            plan["channel_map"][_snap_key(cdata)] = live
+        elif cdata.get("name"):
+            layer = "categories" if cdata.get("type") == "category" else "channels"
+            plan[layer].append(cdata)
+    # categories in legacy snapshots are referenced by name
+    for ch in list(plan["channel_map"].values()):
+        if isinstance(ch, discord.CategoryChannel):
+            plan["channel_map"].setdefault(ch.name, ch)
+    return plan
+
+def _resolve_overwrites(guild, plan, cdata):
+    overwrites = {}
+    for ow in cdata.get("overwrites", []):
+        if ow.get("type") == "role":
+            target = plan["role_map"].get(ow["id"])
+        else:
+            target = guild.get_member(ow["id"]) or discord.Object(id=ow["id"], type=discord.Member)
+        if target is None:
+            continue
+        overwrites[target] = discord.PermissionOverwrite.from_pair(
+            discord.Permissions(ow.get("allow", 0)), discord.Permissions(ow.get("deny", 0))
+        )
+    return overwrites
+
+async def _restore_role(guild, plan, rdata):
+    role = await guild.create_role(
+        name=rdata["name"],
+        permissions=discord.Permissions(rdata.get("permissions", 0)),
+        color=rdata.get("color", 0),
+        hoist=bool(rdata.get("hoist", False)),
+        mentionable=bool(rdata.get("mentionable", False)),
+        reason="Restore snapshot roles"
+    )
+    plan["role_map"][_snap_key(rdata)] = role
+    return role
+
+async def _restore_channel(guild, plan, cdata):
+    name = cdata["name"]
+    ctype = cdata.get("type", "")
+    kwargs = {"reason": "Restore snapshot channel", "overwrites": _resolve_overwrites(guild, plan, cdata)}
+    if ctype == "category":
+        ch = await guild.create_category(name, **kwargs)
+        plan["channel_map"][name] = ch
+    else:
+        category = plan["channel_map"].get(cdata.get("category_id")) or plan["channel_map"].get(cdata.get("category"))
+        if not isinstance(category, discord.CategoryChannel):
+            category = None
+        if ctype in ("text", "news", "forum") and cdata.get("topic"):
+            kwargs["topic"] = cdata["topic"]
+        if ctype in ("text", "news", "forum"):
+            kwargs["nsfw"] = bool(cdata.get("nsfw", False))
+            kwargs["slowmode_delay"] = cdata.get("slowmode_delay") or 0
+        if ctype in ("voice", "stage_voice"):
+            if cdata.get("bitrate"):
+                kwargs["bitrate"] = min(cdata["bitrate"], int(guild.bitrate_limit))
+            if cdata.get("user_limit") is not None:
+                kwargs["user_limit"] = cdata["user_limit"]
+        if ctype in ("text", "news"):
+            ch = await guild.create_text_channel(name, category=category, news=(ctype == "news"), **kwargs)
+        elif ctype == "voice":
+            ch = await guild.create_voice_channel(name, category=category, **kwargs)
+        elif ctype == "stage_voice":
+            ch = await guild.create_stage_channel(name, category=category, **kwargs)
+        elif ctype == "forum":
+            ch = await guild.create_forum(name, category=category, **kwargs)
+        else:
+            return None
+    plan["channel_map"][_snap_key(cdata)] = ch
+    return ch
+
+async def _run_restore_layer(guild, label, items, create, route):
+    """Recrée une couche en parallèle (borné) et logue la progression."""
+    if not items:
+        return 0
+    sem = asyncio.Semaphore(RESTORE_CONCURRENCY)
+    done = 0
+
+    async def one(data):
+        nonlocal done
+        async with sem:
+            try:
+                with rest_timer(route):
+                    created = await create(data)
+                if created is not None:
+                    done += 1
+            except Exception:
+                traceback.print_exc()
+                await send_log(guild, f"⚠️ Erreur en recréant {label}: {data.get('name')}")
+
+    await asyncio.gather(*(one(d) for d in items))
+    await send_log(guild, f"🔄 Restauration {label}: {done}/{len(items)}")
+    return done
+
+async def _restore_positions(guild, plan, snap):
+    """Une mise à jour groupée des positions des salons, une pour les rôles."""
+    payload = []
+    for cdata in snap.get("channels", []):
+        ch = plan["channel_map"].get(_snap_key(cdata))
+        if ch is None or cdata.get("position") is None:
+            continue
+        entry = {"id": ch.id, "position": cdata["position"]}
+        if cdata.get("type") != "category":
+            parent = plan["channel_map"].get(cdata.get("category_id")) or plan["channel_map"].get(cdata.get("category"))
+            entry["parent_id"] = parent.id if isinstance(parent, discord.CategoryChannel) else None
+        payload.append(entry)
+    if payload:
         try:
-            removable_roles = []
-            for r in executor_member.roles:
-                perms = r.permissions
-                if perms.administrator or perms.manage_guild or perms.manage_roles or perms.ban_members or perms.kick_members:
-                    removable_roles.append(r)
-            # remove roles if bot has permissions and role is lower than bot top role
-            if removable_roles:
-                for r in removable_roles:
-                    try:
-                        await executor_member.remove_roles(r, reason="Anti-nuke: removal of sensitive roles")
-                    except Exception:
-                        # continue even if cannot remove some roles
-                        pass
+            with rest_timer("bulk_channel_update"):
+                await bot.http.bulk_channel_update(guild.id, payload, reason="Restore snapshot positions")
         except Exception:
             traceback.print_exc()
 
-        # Finally try to ban
-        reason = f"Anti-nuke auto-ban (actions: {snapshot_counts})"
+    top = guild.me.top_role if guild.me else None
+    positions = {}
+    for rdata in snap.get("roles", []):
+        role = plan["role_map"].get(_snap_key(rdata))
+        if role is None or role.is_default() or role.managed or rdata.get("position") is None:
+            continue
+        if top is not None and role >= top:
+            continue
+        positions[role] = max(1, rdata["position"])
+    if positions:
         try:
-            await guild.ban(executor_member, reason=reason)
-            await send_log(guild, f"⛔ Executor {executor_member} banni. Raison: {reason}")
+            with rest_timer("edit_role_positions"):
+                await guild.edit_role_positions(positions=positions, reason="Restore snapshot positions")
         except Exception:
             traceback.print_exc()
-            await send_log(guild, f"⚠️ Impossible de bannir {executor_member} (permissions manquantes?)")
-    except Exception:
-        traceback.print_exc()
 
-# ---------- RESTORE FROM SNAPSHOT (roles + channels) ----------
 async def restore_from_snapshot(guild):
     """
-    Attempt to restore roles and channels from the saved snapshot (best-effort).
-    - Roles: create missing roles with stored permissions/flags
-    - Channels: recreate missing text/voice channels (no categories/positions/overwrites complexity)
+    Restore roles, categories and channels (with overwrites) from the saved
+    snapshot, layer by layer, then fix positions in bulk (best-effort).
     """
     try:
-        snap = load_snapshot_db(guild.id)
+        snap = await db_run(load_snapshot_db, guild.id)
         if not snap:
             await send_log(guild, "⚠️ Aucun snapshot pour restauration.")
             return False
 
-        await send_log(guild, "🔄 Démarrage restauration depuis snapshot...")
-        # Roles
-        existing_roles = {r.name: r for r in guild.roles}
-        for rdata in snap.get("roles", []):
-            name = rdata.get("name")
-            if not name or name in existing_roles:
-                continue
-            perms_val = rdata.get("permissions", 0)
-            hoist = bool(rdata.get("hoist", False))
-            mentionable = bool(rdata.get("mentionable", False))
-            try:
-                perms = discord.Permissions(perms_val)
-                await guild.create_role(name=name, permissions=perms, hoist=hoist, mentionable=mentionable, reason="Restore snapshot roles")
-                await send_log(guild, f"➕ Rôle restauré: {name}")
-            except Exception:
-                traceback.print_exc()
-                await send_log(guild, f"⚠️ Erreur en créant le rôle: {name}")
-
-        # Channels (text / voice) - minimal recreation
-        existing_ch = {c.name: c for c in guild.channels}
-        for cdata in snap.get("channels", []):
-            cname = cdata.get("name")
-            ctype = cdata.get("type", "")
-            if not cname or cname in existing_ch:
-                continue
-            try:
-                if "text" in ctype:
-                    await guild.create_text_channel(cname, reason="Restore snapshot channel")
-                    await send_log(guild, f"➕ Salon text restauré: {cname}")
-                elif "voice" in ctype:
-                    await guild.create_voice_channel(cname, reason="Restore snapshot channel")
-                    await send_log(guild, f"➕ Salon vocal restauré: {cname}")
-            except Exception:
-                traceback.print_exc()
-                await send_log(guild, f"⚠️ Erreur en créant le salon: {cname}")
-
-        await send_log(guild, "✅ Restauration terminée (tentative).")
+        plan = plan_restore(guild, snap)
+        total = len(plan["roles"]) + len(plan["categories"]) + len(plan["channels"])
+        await send_log(guild, f"🔄 Démarrage restauration depuis snapshot... ({len(plan['roles'])} rôles, "
+                              f"{len(plan['categories'])} catégories, {len(plan['channels'])} salons)")
+        if total == 0:
+            await send_log(guild, "✅ Rien à restaurer.")
+            return True
+
+        restored = 0
+        restored += await _run_restore_layer(guild, "rôles", plan["roles"],
+                                              lambda d: _restore_role(guild, plan, d), "create_role")
+        restored += await _run_restore_layer(guild, "catégories", plan["categories"],
+                                              lambda d: _restore_channel(guild, plan, d), "create_category")
+        restored += await _run_restore_layer(guild, "salons", plan["channels"],
+                                              lambda d: _restore_channel(guild, plan, d), "create_channel")
+        await _restore_positions(guild, plan, snap)
+
+        await send_log(guild, f"✅ Restauration terminée (tentative): {restored}/{total} éléments recréés.")
         return True
     except Exception:
         traceback.print_exc()
@@ -845,38 +2275,24 @@ async def generate_and_persist_nuke_report(guild, executor_id, tracker_snapshot)
             "timestamps": tracker_snapshot,
             "generated_at": int(datetime.utcnow().timestamp())
         }
-        persist_log_event(guild.id, "anti_nuke_report", payload)
+        await queue_log_event(guild.id, "anti_nuke_report", payload)
 
         # Send to configured log channel (or system channel fallback)
         await send_log(guild, f"🚨 Rapport Anti-Nuke: executor {executor_str}, actions totales: {total}")
-        cfg = load_config(guild.id)
+        cfg = await get_config(guild.id)
         log_ch_id = cfg.get("log_channel")
         if log_ch_id:
-            ch = guild.get_channel(log_ch_id)
-            if ch and ch.permissions_for(guild.me).send_messages:
-                try:
-                    await ch.send(embed=emb)
-                except Exception:
-                    await send_log(guild, "⚠️ Impossible d'envoyer l'embed du rapport au canal de log.")
+            await send_log(guild, embed=emb)
         else:
             if guild.system_channel and guild.system_channel.permissions_for(guild.me).send_messages:
                 try:
-                    await guild.system_channel.send(embed=emb)
+                    with rest_timer("channel.send"):
+                        await guild.system_channel.send(embed=emb)
                 except:
                     pass
 
-        # DM owner
-        if OWNER_ID:
-            try:
-                owner = await bot.fetch_user(OWNER_ID)
-                try:
-                    await owner.send(f"🚨 Rapport Anti-Nuke pour {guild.name} — executor: {executor_str}")
-                    await owner.send(embed=emb)
-                except:
-                    # fallback to sending short text
-                    await owner.send(f"🚨 Rapport Anti-Nuke pour {guild.name} — executor: {executor_str} (embed failed)")
-            except:
-                pass
+        # DM owner (digest)
+        notify_owner(f"Rapport Anti-Nuke pour {guild.name} — executor: {executor_str}", "critical", embed=emb)
 
         return payload
     except Exception:
@@ -887,25 +2303,26 @@ async def generate_and_persist_nuke_report(guild, executor_id, tracker_snapshot)
 async def handle_nuke_detection(guild, executor_id, tracker_snapshot):
     """
     Full pipeline when an anti-nuke is detected:
-    1) generate and persist detailed report
-    2) punish executor (remove sensitive roles + ban)
-    3) attempt restoration from snapshot
-    4) persist an after-action event
+    1) contain executor (ban by id) while generating and persisting the detailed report
+    2) attempt restoration from snapshot
+    3) persist an after-action event
     """
     try:
-        # 1) report
-        report_payload = await generate_and_persist_nuke_report(guild, executor_id, tracker_snapshot)
-
-        # 2) punish executor
-        executor_member = guild.get_member(executor_id) or await bot.fetch_user(executor_id)
-        # prepare counts for reason string
+        detected_at = time.monotonic()
         counts = {k: len(v) for k, v in tracker_snapshot.items()}
-        await punish_executor_real(guild, executor_member, counts)
+        # 1) containment + report, en parallèle
+        _, report_payload = await run_guild_actions(
+            guild.id,
+            contain_executor(guild, executor_id, f"Anti-nuke auto-ban (actions: {counts})", detected_at),
+            generate_and_persist_nuke_report(guild, executor_id, tracker_snapshot)
+        )
+        if isinstance(report_payload, BaseException):
+            report_payload = None
 
-        # 3) try restoration (best-effort)
+        # 2) try restoration (best-effort)
         restored = await restore_from_snapshot(guild)
 
-        # 4) persist after-action
+        # 3) persist after-action
         after_payload = {
             "guild_id": guild.id,
             "executor_id": executor_id,
@@ -913,7 +2330,7 @@ async def handle_nuke_detection(guild, executor_id, tracker_snapshot):
             "restored": bool(restored),
             "handled_at": int(datetime.utcnow().timestamp())
         }
-        persist_log_event(guild.id, "anti_nuke_handled", after_payload)
+        await queue_log_event(guild.id, "anti_nuke_handled", after_payload)
 
         # final log message
         await send_log(guild, f"✅ Anti-nuke géré pour executor <@{executor_id}>. Restauration: {'OK' if restored else 'Aucun snapshot/échec'}")
@@ -932,6 +2349,8 @@ async def handle_nuke_detection(guild, executor_id, tracker_snapshot):
 # COMMANDES DE CONFIG, OWNER, EXPORT LOGS, HELP
 # ============================================
 
+import gzip
+import shutil
 import tempfile
 import os
 
@@ -941,16 +2360,16 @@ async def cmd_setlog(ctx, channel: discord.TextChannel):
     """!setlog #channel - définit le canal de logs pour le serveur"""
     if not is_staff(ctx):
         return await ctx.send("❌ Vous n'avez pas la permission.")
-    cfg = load_config(ctx.guild.id)
+    cfg = await get_config(ctx.guild.id)
     cfg["log_channel"] = channel.id
-    save_config(ctx.guild.id, cfg)
+    await db_run(save_config, ctx.guild.id, cfg)
     await ctx.send(f"✅ Canal de log configuré: {channel.mention}")
     await send_log(ctx.guild, f"📌 Canal de log mis à jour par {ctx.author}: {channel.mention}")
 
 @bot.command(name="logstatus")
 async def cmd_logstatus(ctx):
     """!logstatus - affiche le statut du canal de logs"""
-    cfg = load_config(ctx.guild.id)
+    cfg = await get_config(ctx.guild.id)
     ch_id = cfg.get("log_channel")
     if not ch_id:
         return await ctx.send("🔎 Aucun canal de log configuré.")
@@ -963,9 +2382,9 @@ async def cmd_set_nuke_threshold(ctx, amount: int):
     """!set_nuke_threshold <amount> - règle le seuil d'actions pour anti-nuke"""
     if not is_staff(ctx):
         return await ctx.send("❌ Vous n'avez pas la permission.")
-    cfg = load_config(ctx.guild.id)
-    cfg["nuke_actions_limit"] = max(1, amount)
-    save_config(ctx.guild.id, cfg)
+    cfg = await get_config(ctx.guild.id)
+    cfg["nuke_actions_limit"] = min(max(1, amount), TRACKER_RING_SIZE)
+    await db_run(save_config, ctx.guild.id, cfg)
     await ctx.send(f"✅ Seuil anti-nuke réglé à {cfg['nuke_actions_limit']} actions.")
 
 @bot.command(name="set_nuke_window")
@@ -973,9 +2392,9 @@ async def cmd_set_nuke_window(ctx, seconds: int):
     """!set_nuke_window <seconds> - règle la fenêtre temporelle pour le count (seconds)"""
     if not is_staff(ctx):
         return await ctx.send("❌ Vous n'avez pas la permission.")
-    cfg = load_config(ctx.guild.id)
+    cfg = await get_config(ctx.guild.id)
     cfg["nuke_window"] = max(1, seconds)  # using join_window entry as generic time-window
-    save_config(ctx.guild.id, cfg)
+    await db_run(save_config, ctx.guild.id, cfg)
     await ctx.send(f"✅ Fenêtre temporelle anti-nuke réglée à {cfg['join_window']} secondes.")
 
 @bot.command(name="set_antiraid")
@@ -984,9 +2403,9 @@ async def cmd_set_antiraid(ctx, state: str):
     if not is_staff(ctx):
         return await ctx.send("❌ Vous n'avez pas la permission.")
     val = 1 if state.lower() in ("on", "1", "true", "yes") else 0
-    cfg = load_config(ctx.guild.id)
+    cfg = await get_config(ctx.guild.id)
     cfg["antiraid"] = bool(val)
-    save_config(ctx.guild.id, cfg)
+    await db_run(save_config, ctx.guild.id, cfg)
     await ctx.send(f"🛡️ Anti-raid {'activé' if cfg['antiraid'] else 'désactivé'}.")
 
 @bot.command(name="set_joinlimit")
@@ -994,9 +2413,9 @@ async def cmd_set_joinlimit(ctx, amount: int):
     """!set_joinlimit <amount> - nombre de joins pour déclencher l'anti-raid"""
     if not is_staff(ctx):
         return await ctx.send("❌ Vous n'avez pas la permission.")
-    cfg = load_config(ctx.guild.id)
+    cfg = await get_config(ctx.guild.id)
     cfg["join_limit"] = max(1, amount)
-    save_config(ctx.guild.id, cfg)
+    await db_run(save_config, ctx.guild.id, cfg)
     await ctx.send(f"✅ Limite de joins réglée à {cfg['join_limit']}")
 
 @bot.command(name="set_warn_threshold")
@@ -1004,9 +2423,9 @@ async def cmd_set_warn_threshold(ctx, amount: int):
     """!set_warn_threshold <amount> - règle le nombre de warns avant action"""
     if not is_staff(ctx):
         return await ctx.send("❌ Vous n'avez pas la permission.")
-    cfg = load_config(ctx.guild.id)
+    cfg = await get_config(ctx.guild.id)
     cfg["warn_threshold"] = max(1, amount)
-    save_config(ctx.guild.id, cfg)
+    await db_run(save_config, ctx.guild.id, cfg)
     await ctx.send(f"✅ Seuil de warns réglé à {cfg['warn_threshold']}")
 
 @bot.command(name="set_warn_action")
@@ -1017,9 +2436,9 @@ async def cmd_set_warn_action(ctx, action: str):
     action = action.lower()
     if action not in ("mute", "kick", "ban", "none"):
         return await ctx.send("❌ Action invalide. Choix: mute / kick / ban / none")
-    cfg = load_config(ctx.guild.id)
+    cfg = await get_config(ctx.guild.id)
     cfg["warn_action"] = action
-    save_config(ctx.guild.id, cfg)
+    await db_run(save_config, ctx.guild.id, cfg)
     await ctx.send(f"✅ Action automatique sur warn réglée à {action}")
 
 # ---------- OWNER COMMANDS ----------
@@ -1032,52 +2451,163 @@ async def cmd_ownerhelp(ctx):
     embed.add_field(name="!serverlist", value="Affiche la liste des serveurs où le bot est présent et tente de créer une invite", inline=False)
     embed.add_field(name="!whitelist_add <@user>", value="Ajoute un utilisateur à la whitelist du serveur", inline=False)
     embed.add_field(name="!whitelist_remove <@user>", value="Retire un utilisateur de la whitelist du serveur", inline=False)
-    embed.add_field(name="!exportlogs [guild_id]", value="Exporte les logs (owner only). Sans guild_id exporte tous.", inline=False)
+    embed.add_field(name="!exportlogs [guild_id] [since=] [until=] [type=]", value="Exporte les logs en NDJSON gzip (owner only). Sans guild_id (ou 0) exporte tous. Filtres: since=/until= (YYYY-MM-DD), type=a,b", inline=False)
+    embed.add_field(name="!auditstats", value="Statistiques et latence d'attribution des actions (audit log)", inline=False)
     await ctx.send(embed=embed)
 
+@bot.command(name="auditstats")
+async def cmd_auditstats(ctx):
+    """!auditstats - statistiques d'attribution audit log (owner only)"""
+    if ctx.author.id != OWNER_ID:
+        return await ctx.send("❌ Commande réservée au owner.")
+    p50, p99, worst = latency_summary(audit_latencies)
+    c50, c99, cworst = latency_summary(containment_latencies)
+    await ctx.send(
+        f"📊 Attribution audit log — gateway: {audit_stats['gateway']}, REST: {audit_stats['rest']}, "
+        f"non attribuées: {audit_stats['unattributed']}\n"
+        f"Latence p50: {p50:.2f}s, p99: {p99:.2f}s, max: {worst:.2f}s\n"
+        f"🛡 Confinement anti-nuke — réussis: {containment_stats['contained']}, échecs: {containment_stats['failed']}\n"
+        f"Détection → confinement p50: {c50:.2f}s, p99: {c99:.2f}s, max: {cworst:.2f}s"
+    )
+
+@bot.command(name="logstats")
+async def cmd_logstats(ctx, days: int = 7):
+    """!logstats [jours] - nombre d'événements par type sur la période (agrégats)"""
+    if not is_staff(ctx):
+        return await ctx.send("❌ Vous n'avez pas la permission.")
+    days = max(1, days)
+    counts = await db_run(get_log_counts, ctx.guild.id, ts() - days * 86400)
+    if not counts:
+        return await ctx.send(f"🔎 Aucun événement agrégé sur {days} jour(s).")
+    lines = "\n".join(f"`{etype}`: {n}" for etype, n in list(counts.items())[:25])
+    await ctx.send(embed=discord.Embed(title=f"📊 Logs des {days} derniers jours", description=lines, color=0x3498db))
+
 # ---------- EXPORT LOGS (owner only) ----------
-@bot.command(name="exportlogs")
-async def cmd_exportlogs(ctx, guild_id: int = None):
+# Export en flux : curseur itéré ligne par ligne, NDJSON compressé gzip,
+# découpé en fichiers numérotés sous la limite de pièce jointe. L'export
+# ouvre sa propre connexion en lecture seule (WAL) dans un thread à part
+# pour ne pas bloquer le thread DB pendant qu'il tourne.
+EXPORT_DEFAULT_LIMIT = 10 * 1024 * 1024
+EXPORT_MARGIN = 512 * 1024
+
+def _reject_json_constant(name):
+    raise ValueError(f"constante JSON non standard: {name}")
+
+def _export_event_json(ej):
     """
-    !exportlogs [guild_id] - owner only
-    Exporte les logs en JSON. Si guild_id fourni, exporte les logs du serveur; sinon tous les logs.
-    Envoie le fichier en pièce jointe.
+    event_json tel quel s'il a l'air d'un objet / tableau JSON strict (test
+    bon marché), sinon validé ; une valeur invalide (NaN, tronquée, éditée à
+    la main) est exportée comme chaîne JSON pour ne pas casser la ligne.
     """
-    if ctx.author.id != OWNER_ID:
-        return await ctx.send("❌ Commande réservée au owner.")
+    if not ej:
+        return "null"
+    text = ej.strip()
+    if text[:1] in "{[" and text[-1:] in "}]" and "NaN" not in text and "Infinity" not in text:
+        return text
     try:
-        conn = db_connect()
-        cur = conn.cursor()
-        if guild_id:
-            cur.execute("SELECT id, guild_id, event_type, event_json, timestamp FROM logs WHERE guild_id=?", (guild_id,))
-        else:
-            cur.execute("SELECT id, guild_id, event_type, event_json, timestamp FROM logs")
-        rows = cur.fetchall()
+        json.loads(text, parse_constant=_reject_json_constant)
+        return text
+    except ValueError:
+        return json.dumps(ej)
+
+def export_logs_ndjson(out_dir, prefix, max_bytes, guild_id=None, since=None, until=None, event_types=None):
+    """Écrit les logs filtrés en fichiers .ndjson.gz numérotés. Retourne (chemins, nb_lignes)."""
+    # marge pour le bloc gzip encore en tampon, jamais plus de la moitié de la limite
+    part_bytes = max(max_bytes - EXPORT_MARGIN, max_bytes // 2, 1)
+    where, params = [], []
+    if guild_id:
+        where.append("guild_id=?")
+        params.append(guild_id)
+    if since is not None:
+        where.append("timestamp>=?")
+        params.append(since)
+    if until is not None:
+        where.append("timestamp<?")
+        params.append(until)
+    if event_types:
+        where.append(f"event_type IN ({','.join('?' * len(event_types))})")
+        params.extend(event_types)
+    sql = "SELECT id, guild_id, event_type, event_json, timestamp FROM logs"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id"
+
+    paths, count = [], 0
+    raw = gz = None
+    conn = sqlite3.connect(f"file:{DB_NAME}?mode=ro", uri=True)
+    try:
+        for rid, gid, etype, ej, ts_ in conn.execute(sql, params):
+            if gz is None or raw.tell() >= part_bytes:
+                if gz is not None:
+                    gz.close()
+                    raw.close()
+                path = os.path.join(out_dir, f"{prefix}_{len(paths) + 1:03d}.ndjson.gz")
+                raw = open(path, "wb")
+                gz = gzip.GzipFile(fileobj=raw, mode="wb")
+                paths.append(path)
+            # event_json est déjà du JSON : on l'insère tel quel, sans json.loads / dumps
+            gz.write(
+                f'{{"id": {rid}, "guild_id": {json.dumps(gid)}, "event_type": {json.dumps(etype)}, '
+                f'"timestamp": {json.dumps(ts_)}, "event": {_export_event_json(ej)}}}\n'.encode()
+            )
+            count += 1
+    finally:
+        if gz is not None:
+            gz.close()
+            raw.close()
         conn.close()
+    return paths, count
 
-        out = []
-        for r in rows:
-            rid, gid, etype, ej, ts_ = r
-            try:
-                payload = json.loads(ej)
-            except:
-                payload = ej
-            out.append({"id": rid, "guild_id": gid, "event_type": etype, "event": payload, "timestamp": ts_})
+def _parse_export_time(value):
+    """YYYY-MM-DD (UTC) ou timestamp unix."""
+    if value.isdigit():
+        return int(value)
+    return int(datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
 
-        # write to temp file and send
-        with tempfile.NamedTemporaryFile(mode="w+", delete=False, suffix=".json") as tf:
-            json.dump(out, tf, indent=2, default=str)
-            temp_name = tf.name
+@bot.command(name="exportlogs")
+async def cmd_exportlogs(ctx, guild_id: typing.Optional[int] = None, *, filters: str = ""):
+    """
+    !exportlogs [guild_id] [since=YYYY-MM-DD] [until=YYYY-MM-DD] [type=a,b] - owner only
+    Exporte les logs en NDJSON gzip. Si guild_id fourni (0 = tous), exporte les logs du serveur; sinon tous les logs.
+    Envoie un ou plusieurs fichiers numérotés en pièce jointe.
+    """
+    if ctx.author.id != OWNER_ID:
+        return await ctx.send("❌ Commande réservée au owner.")
+    try:
+        since = until = None
+        event_types = None
+        for token in filters.split():
+            key, _, value = token.partition("=")
+            if key == "since":
+                since = _parse_export_time(value)
+            elif key == "until":
+                until = _parse_export_time(value)
+            elif key == "type":
+                event_types = [t for t in value.split(",") if t]
+            else:
+                return await ctx.send(f"❌ Filtre inconnu: `{token}` (since=, until=, type=)")
+    except ValueError:
+        return await ctx.send("❌ Date invalide (format YYYY-MM-DD ou timestamp).")
 
-        await ctx.send(file=discord.File(temp_name, filename=f"logs_{guild_id if guild_id else 'all'}.json"))
-        # cleanup temp file
-        try:
-            os.remove(temp_name)
-        except:
-            pass
+    out_dir = tempfile.mkdtemp(prefix="exportlogs_")
+    try:
+        limit = ctx.guild.filesize_limit if ctx.guild else EXPORT_DEFAULT_LIMIT
+        prefix = f"logs_{guild_id if guild_id else 'all'}"
+        await flush_pending_writes()
+        paths, count = await asyncio.to_thread(
+            export_logs_ndjson, out_dir, prefix, limit, guild_id, since, until, event_types
+        )
+        if not paths:
+            return await ctx.send("🔎 Aucun log ne correspond.")
+        await ctx.send(f"📦 {count} événements exportés en {len(paths)} fichier(s).")
+        for path in paths:
+            await ctx.send(file=discord.File(path, filename=os.path.basename(path)))
     except Exception:
         traceback.print_exc()
         await ctx.send("Erreur lors de l'export des logs.")
+    finally:
+        # cleanup temp files
+        shutil.rmtree(out_dir, ignore_errors=True)
 
 @bot.command(name="aide")
 async def cmd_aide(ctx):
@@ -1155,7 +2685,7 @@ async def cmd_whitelist_add(ctx, user: discord.Member):
     """!whitelist_add @user - ajoute un utilisateur à la whitelist"""
     if not is_staff(ctx) and ctx.author.id != OWNER_ID:
         return await ctx.send("❌ Vous n'avez pas la permission d'ajouter à la whitelist.")
-    add_whitelist(ctx.guild.id, user.id)
+    await db_run(add_whitelist, ctx.guild.id, user.id)
     await ctx.send(f"✅ {user.mention} ajouté à la whitelist.")
     await send_log(ctx.guild, f"➕ {user} ajouté à la whitelist par {ctx.author}.")
 
@@ -1164,7 +2694,7 @@ async def cmd_whitelist_remove(ctx, user: discord.Member):
     """!whitelist_remove @user - retire un utilisateur de la whitelist"""
     if not is_staff(ctx) and ctx.author.id != OWNER_ID:
         return await ctx.send("❌ Vous n'avez pas la permission.")
-    remove_whitelist(ctx.guild.id, user.id)
+    await db_run(remove_whitelist, ctx.guild.id, user.id)
     await ctx.send(f"❌ {user.mention} retiré de la whitelist.")
     await send_log(ctx.guild, f"➖ {user} retiré de la whitelist par {ctx.author}.")
 
@@ -1187,7 +2717,8 @@ async def cmd_roleadd(ctx, user: discord.Member, *, role: discord.Role):
     if not is_staff(ctx):
         return await ctx.send("❌ Vous devez être whitelisté pour utiliser les commandes de rôle.")
     try:
-        await user.add_roles(role, reason=f"Roleadd par {ctx.author}")
+        with rest_timer("member.add_roles"):
+            await user.add_roles(role, reason=f"Roleadd par {ctx.author}")
         await ctx.send(f"✅ {role.name} ajouté à {user.display_name}.")
         await send_log(ctx.guild, f"🎭 Rôle ajouté: {role} → {user} par {ctx.author}")
     except Exception:
@@ -1199,7 +2730,8 @@ async def cmd_roleremove(ctx, user: discord.Member, *, role: discord.Role):
     if not is_staff(ctx):
         return await ctx.send("❌ Vous devez être whitelisté.")
     try:
-        await user.remove_roles(role, reason=f"Roleremove par {ctx.author}")
+        with rest_timer("member.remove_roles"):
+            await user.remove_roles(role, reason=f"Roleremove par {ctx.author}")
         await ctx.send(f"❌ {role.name} retiré à {user.display_name}.")
         await send_log(ctx.guild, f"🎭 Rôle retiré: {role} → {user} par {ctx.author}")
     except:
@@ -1208,6 +2740,7 @@ async def cmd_roleremove(ctx, user: discord.Member, *, role: discord.Role):
 @bot.command(name="roleinfo")
 async def cmd_roleinfo(ctx, *, role: discord.Role):
     """!roleinfo role - info d’un rôle"""
+    await ensure_chunked(ctx.guild)  # role.members a besoin de tous les membres
     embed = discord.Embed(title=f"Infos rôle: {role.name}", color=role.color)
     embed.add_field(name="ID", value=role.id)
     embed.add_field(name="Couleur", value=str(role.color))
@@ -1220,74 +2753,129 @@ async def cmd_roleinfo(ctx, *, role: discord.Role):
 # ANTI BAN/KICK OWNER
 # --------------------------------------------
 
-@bot.event
-async def on_member_remove(member):
-    """Détection kick / ban / leave + protection owner"""
-    guild = member.guild
-    logs = await guild.audit_logs(limit=1, action=discord.AuditLogAction.kick).flatten()
-    banlogs = await guild.audit_logs(limit=1, action=discord.AuditLogAction.ban).flatten()
-
-    executor = None
-    action_type = None
-
-    if logs:
-        entry = logs[0]
-        if entry.target.id == member.id:
-            executor = entry.user
-            action_type = "kick"
-
-    if banlogs:
-        entry = banlogs[0]
-        if entry.target.id == member.id:
-            executor = entry.user
-            action_type = "ban"
-
-    # Aucune action trouvée = leave normal
-    if not executor:
-        return
-
-    # PROTECTION OWNER
-    if member.id == OWNER_ID:
-        # Owner kick
-        if action_type == "kick":
-            try:
+async def protect_owner(guild, action_type, executor):
+    """Appelé par le pipeline audit log quand le owner est kick/ban."""
+    # Owner kick
+    if action_type == "kick":
+        try:
+            with rest_timer("channel.create_invite"):
                 invite = await guild.text_channels[0].create_invite(max_age=0, reason="Protection owner auto reinvite")
-                await send_dm(OWNER_ID, f"⚠️ Vous avez été **kick** du serveur **{guild.name}**.\nVoici un nouvel invite:\n{invite.url}")
-            except:
-                pass
-            await send_log(guild, f"🚨 ANTI-KICK OWNER : {executor} a essayé de kick le owner !")
+            notify_owner(f"Vous avez été **kick** du serveur **{guild.name}**. Nouvel invite: {invite.url}", "critical")
+        except:
+            pass
+        await send_log(guild, f"🚨 ANTI-KICK OWNER : {executor} a essayé de kick le owner !")
 
-        # Owner ban → auto unban + réinvite
-        if action_type == "ban":
-            try:
-                await guild.unban(member, reason="Protection owner auto unban")
+    # Owner ban → unban déjà fait par on_member_ban, on renvoie une invite
+    if action_type == "ban":
+        try:
+            with rest_timer("channel.create_invite"):
                 invite = await guild.text_channels[0].create_invite(max_age=0)
-                await send_dm(OWNER_ID, f"⚠️ Vous avez été **ban**, mais le bot vous a automatiquement **unban**.\nInvite: {invite.url}")
-            except:
-                pass
-            await send_log(guild, f"🚨 ANTI-BAN OWNER : {executor} a essayé de ban le owner !")
-
-        return  # on stoppe ici
-
-    # PROTECTION DU BOT
-    if member.id == bot.user.id:
-        await send_dm(OWNER_ID, f"🚨 Votre bot a été **kick/banni** de **{guild.name}** par {executor}.")
-        return
-
-    # si on arrive ici, ce n’est ni le owner ni le bot
-    # on enregistre quand même dans les logs
-    await send_log(guild, f"⚠️ Membre expulsé/banni: {member} par {executor}")
+            notify_owner(f"Vous avez été **ban** de **{guild.name}**, mais le bot vous a automatiquement **unban**. Invite: {invite.url}", "critical")
+        except:
+            pass
+        await send_log(guild, f"🚨 ANTI-BAN OWNER : {executor} a essayé de ban le owner !")
 
 # --------------------------------------------
 # UTILITAIRE : SEND DM
 # --------------------------------------------
 async def send_dm(user_id, content):
     try:
-        user = bot.get_user(user_id) or await bot.fetch_user(user_id)
-        await user.send(content)
+        user = await resolve_user(user_id)
+        if user is None:
+            return
+        with rest_timer("dm.send"):
+            await user.send(content)
     except:
         pass
 
+# --------------------------------------------
+# NOTIFICATIONS OWNER (digest)
+# --------------------------------------------
+# L'owner et son salon DM sont résolus une seule fois. notify_owner() ne fait
+# qu'empiler : la première alerte d'une rafale part au tick suivant, les
+# suivantes sont regroupées en un digest toutes les OWNER_DIGEST_INTERVAL
+# secondes (alertes identiques fusionnées avec un compteur, triées par
+# sévérité). Un nuke de 300 actions donne quelques DM, pas 300.
+OWNER_DIGEST_INTERVAL = float(os.getenv("OWNER_DIGEST_INTERVAL", "10"))
+OWNER_ALERTS_MAX = 1000
+SEVERITIES = {"critical": "🚨", "warning": "⚠️", "info": "ℹ️"}  # ordre d'affichage
+
+_owner_dm = None
+_owner_alerts = []   # [(severity, texte, embed)]
+_owner_alerts_dropped = 0
+_owner_flush_task = None
+_owner_last_sent = 0.0
+
+async def get_owner_dm():
+    """Salon DM de l'owner (résolu une fois, None si impossible)."""
+    global _owner_dm
+    if _owner_dm is None and OWNER_ID:
+        owner = await resolve_user(OWNER_ID)
+        if owner is None:
+            return None
+        _owner_dm = owner.dm_channel
+        if _owner_dm is None:
+            with rest_timer("create_dm"):
+                _owner_dm = await owner.create_dm()
+    return _owner_dm
+
+def notify_owner(text, severity="warning", embed=None):
+    """Empile une alerte pour l'owner (non bloquant). severity: critical / warning / info."""
+    global _owner_flush_task, _owner_alerts_dropped
+    if not OWNER_ID:
+        return
+    if len(_owner_alerts) >= OWNER_ALERTS_MAX:
+        _owner_alerts_dropped += 1
+        return
+    _owner_alerts.append((severity if severity in SEVERITIES else "warning", text, embed))
+    if _owner_flush_task is None or _owner_flush_task.done():
+        delay = max(0.0, _owner_last_sent + OWNER_DIGEST_INTERVAL - time.monotonic())
+        _owner_flush_task = asyncio.create_task(_flush_owner_alerts_later(delay))
+
+async def _flush_owner_alerts_later(delay):
+    await asyncio.sleep(delay)
+    await flush_owner_alerts()
+
+def _digest_lines(alerts, dropped):
+    counts = OrderedDict()
+    for severity, text, _ in alerts:
+        counts[(severity, text)] = counts.get((severity, text), 0) + 1
+    order = list(SEVERITIES)
+    lines = []
+    for (severity, text), n in sorted(counts.items(), key=lambda kv: order.index(kv[0][0])):
+        lines.append(f"{SEVERITIES[severity]} {text}" + (f" (×{n})" if n > 1 else ""))
+    if len(alerts) > 1:
+        lines.insert(0, f"📋 **{len(alerts)} alertes**")
+    if dropped:
+        lines.append(f"… {dropped} alertes ignorées (file pleine)")
+    return lines
+
+async def flush_owner_alerts():
+    """Envoie toutes les alertes en attente en un digest."""
+    global _owner_alerts, _owner_alerts_dropped, _owner_last_sent, _owner_dm
+    alerts, _owner_alerts = _owner_alerts, []
+    dropped, _owner_alerts_dropped = _owner_alerts_dropped, 0
+    if not alerts:
+        return
+    _owner_last_sent = time.monotonic()
+    try:
+        channel = await get_owner_dm()
+        if channel is None:
+            return
+        for chunk in _chunk_log_lines(_digest_lines(alerts, dropped)):
+            with rest_timer("dm.send"):
+                await channel.send(chunk)
+        for group in _chunk_log_embeds([e for _, _, e in alerts if e is not None]):
+            with rest_timer("dm.send"):
+                await channel.send(embeds=group)
+    except discord.Forbidden:
+        pass  # DM fermés par l'owner
+    except discord.HTTPException:
+        _owner_dm = None  # salon à re-résoudre au prochain digest
+        traceback.print_exc()
+    except Exception:
+        traceback.print_exc()
+
 # ============================================
 # FIN PARTIE 6 / 7
 # ============================================
@@ -1367,7 +2955,114 @@ async def cmd_owneraide(ctx):
 
 
 # --------------------------------------------
-# SERVER L# --------------------------------------------
+# --------------------------------------------
+# CLUSTERS : VUE GLOBALE + COORDINATEUR
+# --------------------------------------------
+# Chaque cluster publie ses serveurs dans cluster_guilds (au démarrage, puis à
+# chaque join / remove). Les commandes owner qui ont besoin d'une vue globale
+# lisent cette table au lieu de bot.guilds.
+CLUSTER_START_DELAY = 5  # secondes entre deux lancements (limite d'IDENTIFY)
+# Relance d'un cluster arrêté : backoff exponentiel (CLUSTER_START_DELAY x 2^échecs,
+# plafonné), remis à zéro après CLUSTER_HEALTHY_UPTIME secondes de marche ;
+# abandon après CLUSTER_MAX_FAILURES arrêts rapprochés (token invalide,
+# migration en erreur, IDENTIFY refusé...) pour ne pas épuiser les sessions.
+CLUSTER_BACKOFF_MAX = 300
+CLUSTER_HEALTHY_UPTIME = 300
+CLUSTER_MAX_FAILURES = 5
+CLUSTER_GUILD_SQL = ("INSERT OR REPLACE INTO cluster_guilds (guild_id, cluster_id, shard_id, name, member_count, updated_at) "
+                     "VALUES (?, ?, ?, ?, ?, ?)")
+
+def cluster_guild_row(guild):
+    return (guild.id, CLUSTER_ID, shard_of(guild.id), guild.name, guild.member_count or 0, ts())
+
+def replace_cluster_guilds_db(cluster_id, rows):
+    with db_batch():
+        db_write("DELETE FROM cluster_guilds WHERE cluster_id=?", (cluster_id,))
+        db_write_many(CLUSTER_GUILD_SQL, rows)
+
+def upsert_cluster_guilds_db(rows):
+    db_write_many(CLUSTER_GUILD_SQL, rows)
+
+def remove_cluster_guild_db(guild_id):
+    db_write("DELETE FROM cluster_guilds WHERE guild_id=?", (guild_id,))
+
+def list_cluster_guilds_db():
+    return db_fetchall("SELECT guild_id, name, member_count, cluster_id, shard_id FROM cluster_guilds ORDER BY cluster_id, name")
+
+async def publish_cluster_guilds():
+    if CLUSTERED:
+        await db_run(replace_cluster_guilds_db, CLUSTER_ID, [cluster_guild_row(g) for g in bot.guilds])
+
+async def global_guild_list():
+    """[(guild_id, nom, membres, cluster_id, shard_id)] de tous les clusters."""
+    if CLUSTERED:
+        return await db_run(list_cluster_guilds_db)
+    return [(g.id, g.name, g.member_count, CLUSTER_ID, g.shard_id) for g in bot.guilds]
+
+def run_clusters(clusters):
+    """
+    Coordinateur : répartit SHARD_COUNT shards (par défaut un par cluster) sur
+    `clusters` processus, les lance un par un et relance ceux qui s'arrêtent
+    (avec backoff, abandon après CLUSTER_MAX_FAILURES arrêts rapprochés).
+    """
+    shard_count = SHARD_COUNT or clusters
+    if clusters > shard_count:
+        print(f"[cluster] {clusters} clusters pour {shard_count} shards : limité à {shard_count}")
+        clusters = shard_count
+    init_db()  # migrations appliquées une fois, avant les workers
+
+    def spawn(cluster_id):
+        shard_ids = [s for s in range(shard_count) if s % clusters == cluster_id]
+        env = dict(os.environ, SHARD_COUNT=str(shard_count), CLUSTER_ID=str(cluster_id),
+                   SHARD_IDS=",".join(map(str, shard_ids)))
+        print(f"[cluster] lancement du cluster {cluster_id} (shards {shard_ids}/{shard_count})")
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+    procs = {}       # {cluster_id: Popen} clusters en marche
+    started = {}     # {cluster_id: time.monotonic() du lancement}
+    failures = {}    # {cluster_id: arrêts rapprochés consécutifs}
+    restart_at = {}  # {cluster_id: time.monotonic() de la prochaine relance}
+    try:
+        for cluster_id in range(clusters):
+            procs[cluster_id] = spawn(cluster_id)
+            started[cluster_id] = time.monotonic()
+            time.sleep(CLUSTER_START_DELAY)
+        last_spawn = time.monotonic()
+        while procs or restart_at:
+            time.sleep(1)
+            now = time.monotonic()
+            for cluster_id, proc in list(procs.items()):
+                if proc.poll() is None:
+                    continue
+                del procs[cluster_id]
+                uptime = now - started[cluster_id]
+                failures[cluster_id] = 0 if uptime >= CLUSTER_HEALTHY_UPTIME else failures.get(cluster_id, 0) + 1
+                if failures[cluster_id] >= CLUSTER_MAX_FAILURES:
+                    print(f"[cluster] cluster {cluster_id} arrêté {failures[cluster_id]} fois de suite "
+                          f"(code {proc.returncode}), abandon")
+                    continue
+                delay = min(CLUSTER_START_DELAY * 2 ** failures[cluster_id], CLUSTER_BACKOFF_MAX)
+                print(f"[cluster] cluster {cluster_id} arrêté (code {proc.returncode}) après {uptime:.0f}s, "
+                      f"relance dans {delay:.0f}s")
+                restart_at[cluster_id] = now + delay
+            for cluster_id, when in sorted(restart_at.items(), key=lambda kv: kv[1]):
+                # un seul lancement par CLUSTER_START_DELAY, tous clusters confondus
+                if when > now or now - last_spawn < CLUSTER_START_DELAY:
+                    break
+                del restart_at[cluster_id]
+                procs[cluster_id] = spawn(cluster_id)
+                started[cluster_id] = last_spawn = now
+        print("[cluster] plus aucun cluster actif, arrêt du coordinateur")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in procs.values():
+            proc.terminate()
+        for proc in procs.values():
+            proc.wait()
+        db_close()
+
+# --------------------------------------------
 # SERVER LIST COMMAND
 # --------------------------------------------
 @bot.command(name="serverlist")
@@ -1375,18 +3070,19 @@ async def serverlist(ctx):
     if ctx.author.id != OWNER_ID:
         return await ctx.send("❌ Accès owner uniquement.")
 
+    guilds = await global_guild_list()
     embed = discord.Embed(
         title="📜 Serveurs du bot",
-        description=f"{len(bot.guilds)} serveurs",
+        description=f"{len(guilds)} serveurs" + (f" sur {SHARD_COUNT} shards" if SHARD_COUNT else ""),
         color=discord.Color.blue()
     )
 
     view = View()
 
-    for i, guild in enumerate(bot.guilds[:25]):  # LIMITE DISCORD
+    for guild_id, name, member_count, cluster_id, shard_id in guilds[:25]:  # LIMITE DISCORD
         embed.add_field(
-            name=guild.name,
-            value=f"ID: {guild.id} | Membres: {guild.member_count}",
+            name=name,
+            value=f"ID: {guild_id} | Membres: {member_count}" + (f" | Cluster {cluster_id} / shard {shard_id}" if SHARD_COUNT else ""),
             inline=False
         )
 
@@ -1398,47 +3094,86 @@ async def serverlist(ctx):
     view.add_item(Button(label="➕ Inviter le bot", url=invite_url))
     await ctx.send(embed=embed, view=view)
 
+# --------------------------------------------
+# AUDIT DES COMMANDES
+# --------------------------------------------
+# Le check global ne fait qu'empiler l'entrée ; une tâche la traite par lots
+# toutes les COMMAND_AUDIT_INTERVAL secondes (ligne dans la file de logs du
+# serveur + insertion tamponnée dans la table logs). Aucune commande
+# n'attend Discord ni la base pour s'exécuter.
+COMMAND_AUDIT_INTERVAL = 1.0
+COMMAND_AUDIT_MAX = 5000
+
+_command_audit = deque(maxlen=COMMAND_AUDIT_MAX)  # (guild, ligne, payload)
+_command_audit_task = None
+
+def audit_command(ctx):
+    global _command_audit_task
+    _command_audit.append((
+        ctx.guild,
+        f"💬 Cmd: {ctx.command} utilisée par {ctx.author}",
+        {"command": ctx.command.qualified_name, "user_id": ctx.author.id, "channel_id": ctx.channel.id}
+    ))
+    if _command_audit_task is None or _command_audit_task.done():
+        _command_audit_task = asyncio.create_task(_flush_command_audit_later())
+
+async def _flush_command_audit_later():
+    await asyncio.sleep(COMMAND_AUDIT_INTERVAL)
+    await flush_command_audit()
+
+async def flush_command_audit():
+    """Traite toutes les entrées d'audit de commandes en attente."""
+    while _command_audit:
+        guild, line, payload = _command_audit.popleft()
+        try:
+            await send_log(guild, line)
+            await queue_log_event(guild.id, "command", payload)
+        except Exception:
+            traceback.print_exc()
+
 # --------------------------------------------
 # GLOBAL CHECK POUR COMMANDES
 # --------------------------------------------
+# Commandes réservées owner / whitelist
+STAFF_COMMANDS = frozenset({
+    "kick", "ban", "mute", "unmute", "clear", "lock", "unlock",
+    "warn", "warns", "clearwarns", "set_warn_threshold", "set_warn_action",
+    "set_antiraid", "set_joinlimit", "snapshot", "restore", "setlog",
+    "lockdown", "set_lockdown_duration", "logstats",
+    "whitelist_add", "whitelist_remove", "whitelist"
+})
+
 @bot.check
 async def global_command_check(ctx):
-    """Check global avant toute commande"""
+    """Check global avant toute commande (mémoire uniquement)"""
     if ctx.guild is None:
         return True  # DM autorisées
-    # log command
-    await send_log(ctx.guild, f"💬 Cmd: {ctx.command} utilisée par {ctx.author}")
+    audit_command(ctx)
     # check whitelist / owner pour commandes modération
-    if ctx.command.name in [
-        "kick","ban","mute","unmute","clear","lock","unlock",
-        "warn","warns","clearwarns","set_warn_threshold","set_warn_action",
-        "set_antiraid","set_joinlimit","snapshot","setlog",
-        "whitelist_add","whitelist_remove","whitelist"
-    ]:
-        if not is_staff(ctx):
-            await ctx.send("❌ Vous devez être whitelisté pour utiliser cette commande.")
-            return False
+    if ctx.command.name in STAFF_COMMANDS and not is_staff(ctx):
+        await ctx.send("❌ Vous devez être whitelisté pour utiliser cette commande.")
+        return False
     return True
 
-# --------------------------------------------
-# ON_READY FINAL
-# --------------------------------------------
-    init_db()
-    print(f"🤖 Bot prêt: {bot.user} (ID: {bot.user.id})")
-    for guild in bot.guilds:
-        print(f"🔹 Connecté à {guild.name} (ID: {guild.id})")
-    # DM owner
-    if OWNER_ID:
-        try:
-            owner = await bot.fetch_user(OWNER_ID)
-            await owner.send(f"✅ {bot.user} est connecté sur {len(bot.guilds)} serveurs !")
-        except:
-            pass
-
 # --------------------------------------------
 # RUN BOT
 # --------------------------------------------
 if __name__ == "__main__":
+    if "--clusters" in sys.argv:
+        try:
+            clusters = int(sys.argv[sys.argv.index("--clusters") + 1])
+        except (IndexError, ValueError):
+            raise SystemExit("Usage: python main.py --clusters N (N >= 1)")
+        if clusters < 1:
+            raise SystemExit("Usage: python main.py --clusters N (N >= 1)")
+        run_clusters(clusters)
+        raise SystemExit(0)
     init_db()
-    bot.run(TOKEN)
+    load_whitelists()
+    try:
+        bot.run(TOKEN)
+    finally:
+        _db_executor.shutdown(wait=True)
+        flush_pending_writes_sync()
+        db_close()
 